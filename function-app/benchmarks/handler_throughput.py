@@ -0,0 +1,87 @@
+"""
+Benchmark of the concurrent request throughput of a single worker - comparing sync handlers (run on the worker's sync thread pool) against the async handlers (which offload the blocking calls to the prompt worker pool)
+
+The model call is simulated by a proxy that sleeps for the given latency (as the real proxies are blocked on I/O for almost all of a request).
+
+The handlers' blocking calls are still run on threads, so the gain comes from the size of the dedicated prompt worker pool (PROMPT_WORKER_THREADS) rather than from async itself -
+the sync handlers are also run on a pool of the same size, which should give (about) the same throughput as the async handlers.
+
+Usage (from the function-app folder):
+    python -m benchmarks.handler_throughput [requests] [latency-secs] [sync-threads]
+
+[sync-threads] defaults to the Python worker's default for sync functions (PYTHON_THREADPOOL_THREAD_COUNT, otherwise min(32, cpus + 4))
+"""
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.workers import run_blocking, get_prompt_executor, worker_stats
+
+AUTH_LATENCY_SECS = 0.005
+HISTORY_LATENCY_SECS = 0.01
+
+
+class FakeProxy:
+    def __init__(self, latency_secs:float) -> None:
+        self.latency_secs = latency_secs
+
+    def send_message(self, prompt:str) -> str:
+        time.sleep(self.latency_secs)
+        return prompt
+
+
+def sync_handler(proxy:FakeProxy, prompt:str) -> str:
+    ## The previous handlers - every step blocks the thread the handler is run on
+    time.sleep(AUTH_LATENCY_SECS)
+    time.sleep(HISTORY_LATENCY_SECS)
+    return proxy.send_message(prompt)
+
+
+async def async_handler(proxy:FakeProxy, prompt:str) -> str:
+    ## As per the handlers - each blocking step is awaited on the prompt worker pool
+    await run_blocking(time.sleep, AUTH_LATENCY_SECS)
+    def send():
+        time.sleep(HISTORY_LATENCY_SECS)
+        return proxy.send_message(prompt)
+    return await run_blocking(send)
+
+
+async def run_sync(requests:int, proxy:FakeProxy, threads:int) -> float:
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = time.perf_counter()
+        await asyncio.gather(*[ loop.run_in_executor(executor, sync_handler, proxy, str(idx)) for idx in range(requests) ])
+        return time.perf_counter() - start
+
+
+async def run_async(requests:int, proxy:FakeProxy) -> float:
+    get_prompt_executor()
+    start = time.perf_counter()
+    await asyncio.gather(*[ async_handler(proxy, str(idx)) for idx in range(requests) ])
+    return time.perf_counter() - start
+
+
+def main(requests:int = 500, latency_secs:float = 0.5, sync_threads:int = None):
+    if sync_threads is None:
+        sync_threads = int(os.environ.get("PYTHON_THREADPOOL_THREAD_COUNT", min(32, (os.cpu_count() or 1) + 4)))
+    proxy = FakeProxy(latency_secs)
+
+    sync_elapsed = asyncio.run(run_sync(requests, proxy, sync_threads))
+    pool_threads = worker_stats()['max-workers']
+    sync_pool_elapsed = asyncio.run(run_sync(requests, proxy, pool_threads))
+    async_elapsed = asyncio.run(run_async(requests, proxy))
+    print(f"{requests} concurrent requests, {latency_secs * 1000:.0f} ms model latency")
+    print(f"sync  ({sync_threads} threads):  {requests / sync_elapsed:8.1f} req/s  ({sync_elapsed:.2f} s)")
+    print(f"sync  ({pool_threads} threads):  {requests / sync_pool_elapsed:8.1f} req/s  ({sync_pool_elapsed:.2f} s)")
+    print(f"async ({worker_stats()['max-workers']} workers):  {requests / async_elapsed:8.1f} req/s  ({async_elapsed:.2f} s, {sync_elapsed / async_elapsed:.1f}x)")
+    print(f"peak in-flight blocking calls: {worker_stats()['peak-in-flight']}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.5,
+        int(sys.argv[3]) if len(sys.argv) > 3 else None,
+    )
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of ReqContext.get_req_val - comparing the indexed lookup against the previous implementation (which checked each source in turn)
+
+Usage (from the function-app folder):
+    python -m benchmarks.req_val_lookup [iterations]
+"""
+import sys
+import timeit
+
+from data.req_context import ReqContext, _FakeRequest
+
+
+def legacy_get_req_val(context:ReqContext, field:str, default_val:any = None) -> any:
+    ## The lookup as it was before the index was added (body, params, route params, then the headers 3 times)
+    val = None
+    if context.body is not None: 
+        val = context.body.get(field, None)
+    if val is None and context.req is not None: 
+        if val is None:
+            val = context.req.params.get(field, None)
+        if val is None:
+            val = context.req.route_params.get(field, None)
+        if val is None:
+            val = context.req.headers.get(field, None)
+        if val is None:
+            val = context.req.headers.get(field.lower(), None)
+        if val is None:
+            val = context.req.headers.get(field.title(), None)
+    return val if val is not None else default_val
+
+
+def build_context() -> ReqContext:
+    return ReqContext(_FakeRequest({
+        "method": "POST",
+        "body": { "prompt": "Hello", "use-functions": "true", "channelData": {}, "text": None },
+        "params": { "config": "default", "timeout": "60" },
+        "route_params": {},
+        "headers": { "content-type": "application/json", "x-config": "default", "Stream-Id": "abc", "user-agent": "benchmark" },
+    }))
+
+
+## A mix of the lookups made whilst handling a request (hits in each source + misses)
+FIELDS = [ "prompt", "use-functions", "timeout", "stream-id", "channelData", "orchestrator", "thread", "thread-id", "conversation", "conversation-id", "conversation_id", "bot-conversation-id" ]
+
+
+def main(iterations:int = 20000):
+    context = build_context()
+    for field in FIELDS:
+        assert context.get_req_val(field) == legacy_get_req_val(context, field), field
+
+    legacy = timeit.timeit(lambda: [ legacy_get_req_val(context, field) for field in FIELDS ], number=iterations)
+    indexed = timeit.timeit(lambda: [ context.get_req_val(field) for field in FIELDS ], number=iterations)
+    lookups = iterations * len(FIELDS)
+    print(f"legacy:  {legacy / lookups * 1e9:8.1f} ns/lookup")
+    print(f"indexed: {indexed / lookups * 1e9:8.1f} ns/lookup  ({legacy / indexed:.2f}x)")
+
+    ## Per request cost (the index is built on the first lookup of each request)
+    legacy = timeit.timeit(lambda: [ legacy_get_req_val(ctx, field) for ctx in [build_context()] for field in FIELDS ], number=iterations // 10)
+    indexed = timeit.timeit(lambda: [ ctx.get_req_val(field) for ctx in [build_context()] for field in FIELDS ], number=iterations // 10)
+    print(f"per request (incl. building the context): legacy {legacy / (iterations // 10) * 1e6:.2f} us, indexed {indexed / (iterations // 10) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -225,11 +225,10 @@ class BotframeworkFacade:
         ## Process the user's activity message
         ## This is a requirement of the botframework's web client
         from uuid import uuid4
-        from aiproxy.orchestration import orchestrator_factory
-        from aiproxy.data import ChatConfig
+        from utils.orchestrator_cache import load_orchestrator, release_orchestrator
         ## Grab Other Request Specific Settings
         use_functions = self._context.get_req_val("use-functions", 'true').lower() in ['true', 'yes', '1']
-        timeout_secs = int(self._context.get_req_val("timeout", self._context.get_req_val("timeout-secs", "90")))
+        timeout_secs = int(self._context.get_first_req_val("timeout", "90"))
 
         ## Grab the channel data from the activity payload
         channel_data = self._context.get_req_val("channelData", {})
@@ -257,7 +256,6 @@ class BotframeworkFacade:
         ## Load the Orchestrator / Proxy to use for this request
         proxy = None
         try: 
-            orchestrator_config = None
             orchestrator_name = override_orchestrator
             if orchestrator_name is None:
                 orchestrator_name = channel_data.get("orchestrator", None)
@@ -265,18 +263,9 @@ class BotframeworkFacade:
                 orchestrator_name = self._context.get_req_val("orchestrator", None) or self._context.get_config_value("orchestrator", None)
             if orchestrator_name is None: 
                 orchestrator_name = self._context.get_config_value("default-orchestrator", DEFAULT_BOT_ORCHESTRATOR)
-                orchestrator_config = ChatConfig.load(orchestrator_name, False)
-            else: 
-                orchestrator_config = ChatConfig.load(orchestrator_name, False)
-
-            if orchestrator_config is None: 
-                ## Create a default Config
-                orchestrator_config = self._context.config.clone()
-                orchestrator_config['type'] = self._context.get_req_val("orchestrator-type", None) or self._context.get_config_value("orchestrator-type", None) or DEFAULT_BOT_ORCHESTRATOR
-                orchestrator_config['name'] = orchestrator_name
-                
-            ## Load the Orchestrator/Proxy and send the message
-            proxy = orchestrator_factory(orchestrator_config)
+
+            ## Load the Orchestrator/Proxy (from its cached config)
+            proxy = load_orchestrator(orchestrator_name, self._context, DEFAULT_BOT_ORCHESTRATOR)
         except Exception as e: 
             import logging
             import traceback
@@ -375,6 +364,7 @@ class BotframeworkFacade:
             return False
         finally: 
             waiting_event.set() ## Ensure that the waiting event is set to stop the typing activity
+            release_orchestrator(proxy)  ## The turn is done with the Orchestrator, so it can be used by the next one
 
     def echo_user_activity(self):
         ## Echo the user's activity message back to them (via the stream) to ACK receipt of the message
@@ -385,7 +375,7 @@ class BotframeworkFacade:
         activity.from_data = self._context.get_req_val("from", {})
         activity.recipient = { "id": self.bot_id, "name": self.bot_name }
         activity.textFormat = self._context.get_req_val("textFormat", "plain")
-        activity.text = self._context.get_req_val("text") or self._context.get_req_val("prompt")
+        activity.text = self._context.get_first_req_val("text")
         activity.entities = self._context.get_req_val("entities", [])
         activity.channelData = self._context.get_req_val("channelData", {})
         resp = BotFrameworkActivityResponse.new_with_activity(activity)
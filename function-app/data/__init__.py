@@ -1,2 +1,3 @@
 
 from .req_context import ReqContext
+from .static_context import StaticContext
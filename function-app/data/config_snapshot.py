@@ -0,0 +1,188 @@
+import os
+import threading
+from types import MappingProxyType
+
+from aiproxy.data import ChatConfig
+
+_MISSING = object()
+
+
+class ConfigSnapshot:
+    """
+    A read-only, versioned view of a loaded config, used for fast `get_config_value` lookups.
+
+    The values are read through the ChatConfig (so it remains the one source of truth for them, incl. resolving `!file.txt` references) once, when the config is loaded or refreshed.
+    The version of a config only changes when its content changes, so it can be used to key other caches (eg. compiled rules, resolved configs).
+    """
+    name:str = None
+    version:int = None
+    content_hash:str = None
+    config:ChatConfig = None
+    values:MappingProxyType = None
+
+    def __init__(self, name:str, config:ChatConfig, values:dict, version:int, content_hash:str) -> None:
+        self.name = name
+        self.config = config
+        self.values = MappingProxyType(values) if values is not None else None
+        self.version = version
+        self.content_hash = content_hash
+        self._others:dict = {}     ## Fields that aren't in the captured values, as read from the config (on first use)
+
+    @property
+    def key(self) -> tuple[str, int]:
+        """
+        A key that identifies this version of the config (for use by other caches)
+        """
+        return (self.name, self.version)
+
+    def __contains__(self, config_field:str) -> bool:
+        return self._read(config_field) is not None
+
+    def get(self, config_field:str, default_value:any = None, fallback_to_env:bool = True) -> any:
+        """
+        Returns the config value, otherwise the env variable of the same (upper case) name (if fallback_to_env), otherwise the default value
+        """
+        val = self._read(config_field)
+        if val is None and fallback_to_env:
+            val = get_env_value(config_field)
+        return val if val is not None else default_value
+
+    def _read(self, config_field:str) -> any:
+        if self.values is not None:
+            val = self.values.get(config_field, _MISSING)
+            if val is not _MISSING: return val
+        val = self._others.get(config_field, _MISSING)
+        if val is _MISSING:
+            ## Not one of the captured fields (eg. a field the config provides a value for without it being in the record), so read it through the config (once)
+            val = self.config[config_field] if config_field in self.config else None
+            self._others[config_field] = val
+        return val
+
+
+_SNAPSHOTS:dict[str, tuple[object, ConfigSnapshot]] = {}
+_SNAPSHOTS_BY_HASH:dict[tuple[str, str], ConfigSnapshot] = {}     ## (name, content hash) -> snapshot
+_SNAPSHOTS_BY_CONFIG:dict[int, tuple[ChatConfig, ConfigSnapshot]] = {}   ## id(config) -> (config, snapshot)
+_VERSIONS:dict[str, tuple[str, int]] = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+_ENV_VALUES:dict[str, str] = {}
+MAX_UNCACHED_CONFIG_SNAPSHOTS = 128
+
+
+def get_env_value(config_field:str) -> str:
+    """
+    Returns the env variable used as the fallback for a config field (memoised, env variables don't change whilst the app is running)
+    """
+    val = _ENV_VALUES.get(config_field, _MISSING)
+    if val is _MISSING:
+        val = os.environ.get(config_field.upper(), None)
+        _ENV_VALUES[config_field] = val
+    return val
+
+
+def get_config_snapshot(name:str, config:ChatConfig = None) -> ConfigSnapshot:
+    """
+    Get the snapshot of the named config, re-using the current snapshot for as long as the config cache holds the same entry for the config.
+
+    If the config is not provided, it is loaded (and None is returned if there is no config with the name)
+    """
+    from aiproxy.utils.config import CACHED_CONFIGS
+    marker = CACHED_CONFIGS.get(name, None) if name is not None else None
+    entry = _SNAPSHOTS.get(name, None)
+    if entry is not None and marker is not None and entry[0] is marker:
+        return entry[1]
+
+    if config is None:
+        config = ChatConfig.load(name, False)
+        if config is None: return None
+        marker = CACHED_CONFIGS.get(name, None)
+
+    snapshot = build_config_snapshot(name, config, marker)
+    if marker is not None:
+        with _SNAPSHOTS_LOCK:
+            _SNAPSHOTS[name] = (marker, snapshot)
+    return snapshot
+
+
+def build_config_snapshot(name:str, config:ChatConfig, raw:any = None) -> ConfigSnapshot:
+    """
+    Build a snapshot of the config, bumping the version of the config if its content has changed since the last snapshot.
+
+    Snapshots are re-used for the same config (object), and for a config with the same content - so configs that aren't in the config cache aren't re-read + re-hashed for every request
+    """
+    import json
+    import hashlib
+    existing = _SNAPSHOTS_BY_CONFIG.get(id(config), None)
+    if existing is not None and existing[0] is config and existing[1].name == name:
+        return existing[1]
+
+    values = _extract_values(config, raw)
+    if values is not None:
+        content_hash = hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    else:
+        content_hash = str(id(config))
+
+    with _SNAPSHOTS_LOCK:
+        snapshot = _SNAPSHOTS_BY_HASH.get((name, content_hash), None)
+        version = _VERSIONS.get(name, (None, 0))
+        if snapshot is None or version[0] != content_hash:
+            ## New content (or content that has changed back), so it's a new version of the config
+            if version[0] != content_hash:
+                version = (content_hash, version[1] + 1)
+                if name is not None:
+                    _VERSIONS[name] = version
+            snapshot = ConfigSnapshot(name, config, values, version[1], content_hash)
+            _SNAPSHOTS_BY_HASH[(name, content_hash)] = snapshot
+            while len(_SNAPSHOTS_BY_HASH) > MAX_UNCACHED_CONFIG_SNAPSHOTS:
+                _SNAPSHOTS_BY_HASH.pop(next(iter(_SNAPSHOTS_BY_HASH)))
+        ## The config is held by the entry, so its id can't be re-used whilst the entry exists
+        _SNAPSHOTS_BY_CONFIG[id(config)] = (config, snapshot)
+        while len(_SNAPSHOTS_BY_CONFIG) > MAX_UNCACHED_CONFIG_SNAPSHOTS:
+            _SNAPSHOTS_BY_CONFIG.pop(next(iter(_SNAPSHOTS_BY_CONFIG)))
+    return snapshot
+
+
+def reset_config_snapshots():
+    """
+    Drop all the snapshots (+ the memoised env values), the versions are kept so they keep increasing
+    """
+    with _SNAPSHOTS_LOCK:
+        _SNAPSHOTS.clear()
+        _SNAPSHOTS_BY_HASH.clear()
+        _SNAPSHOTS_BY_CONFIG.clear()
+        _ENV_VALUES.clear()
+
+
+def refresh_config_snapshots(names:list[str] = None) -> list[str]:
+    """
+    Re-snapshot the cached configs (eg. after they have been reloaded), returning the names of the configs whose content has changed
+    """
+    from aiproxy.utils.config import CACHED_CONFIGS
+    changed = []
+    for name in list(names if names is not None else CACHED_CONFIGS.keys()):
+        prev = _VERSIONS.get(name, None)
+        snapshot = get_config_snapshot(name)
+        if snapshot is None or prev is None or _VERSIONS.get(name, None) != prev:
+            changed.append(name)
+    return changed
+
+
+def _extract_values(config:ChatConfig, raw:any = None) -> dict:
+    ## Read the values of all the fields of the config through the ChatConfig (which resolves them, eg. `!file` references)
+    ## The raw record (if there is one) is only used for the names of the fields
+    from collections.abc import Mapping
+    fields = None
+    for candidate in (raw, config):
+        if isinstance(candidate, Mapping):
+            fields = list(candidate.keys())
+            break
+    if fields is None:
+        to_dict = getattr(config, "to_dict", None)
+        if callable(to_dict):
+            try:
+                record = to_dict()
+                if isinstance(record, Mapping):
+                    fields = list(record.keys())
+            except Exception:
+                pass
+    if fields is None: return None
+    return { field:config[field] for field in fields if field in config }
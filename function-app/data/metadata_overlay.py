@@ -0,0 +1,186 @@
+MAX_OVERLAY_DEPTH = 8
+
+_TOMBSTONE = object()   ## Marks a key that has been removed in the overlay (but is still set in the parent)
+_NOT_EMPTY = object()   ## A (tombstoned) key that is always held, as C code (eg. the json encoder) treats a dict with no entries of its own as empty, without calling `items()`
+
+
+class MetadataOverlay(dict):
+    """
+    A copy-on-write view of the metadata of a parent context (used by cloned contexts, so cloning doesn't copy the metadata).
+
+    Reads fall through to the parent, whilst writes + removals are held in the overlay - so they never affect the parent.
+    Like a ChainMap, the parent is a live view (changes made to the parent after cloning are seen by the overlay, unless overridden by it).
+    Use `merge_into` to apply the changes made in the overlay back onto the parent (or any other dict).
+
+    It is a dict (so it can be used anywhere the metadata dict is), but the dict itself only holds the changes - `copy()` returns a flattened, plain dict.
+    """
+    __slots__ = ("parent", "depth")
+
+    def __init__(self, parent:dict) -> None:
+        super().__init__()
+        dict.__setitem__(self, _NOT_EMPTY, _TOMBSTONE)
+        depth = parent.depth + 1 if isinstance(parent, MetadataOverlay) else 1
+        if depth > MAX_OVERLAY_DEPTH:
+            ## Don't let chains of overlays (eg. clones of clones) get too deep, as every read of a missing key walks the whole chain
+            parent = parent.copy()
+            depth = 1
+        self.parent = parent
+        self.depth = depth
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            val = dict.__getitem__(self, key)
+            if val is _TOMBSTONE: raise KeyError(key)
+            return val
+        return self.parent[key]
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            val = dict.__getitem__(self, key)
+            return default if val is _TOMBSTONE else val
+        return self.parent.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key) is not _TOMBSTONE
+        return key in self.parent
+
+    def __setitem__(self, key, val):
+        dict.__setitem__(self, key, val)
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError(key)
+        dict.__setitem__(self, key, _TOMBSTONE)
+
+    def pop(self, key, *default):
+        if key in self:
+            val = self[key]
+            dict.__setitem__(self, key, _TOMBSTONE)
+            return val
+        if len(default) > 0: return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        for key in reversed(list(self.keys())):
+            return (key, self.pop(key))
+        raise KeyError("popitem(): metadata is empty")
+
+    def setdefault(self, key, default=None):
+        if key in self: return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        for key, val in dict(*args, **kwargs).items():
+            self[key] = val
+
+    def clear(self):
+        dict.clear(self)
+        dict.__setitem__(self, _NOT_EMPTY, _TOMBSTONE)
+        ## Every key of the parent is hidden (incl. those that were already removed in the overlay)
+        for key in list(self.parent):
+            dict.__setitem__(self, key, _TOMBSTONE)
+
+    def copy(self) -> dict:
+        """
+        Returns a flattened (plain dict) copy of the metadata
+        """
+        flat = self.parent.copy() if isinstance(self.parent, MetadataOverlay) else dict(self.parent)
+        for key, val in dict.items(self):
+            if val is _TOMBSTONE:
+                flat.pop(key, None)
+            else:
+                flat[key] = val
+        return flat
+
+    def changes(self) -> tuple[dict, set]:
+        """
+        Returns the changes made in the overlay, as the (set values, removed keys)
+        """
+        updated = {}
+        removed = set()
+        for key, val in dict.items(self):
+            if key is _NOT_EMPTY: continue
+            if val is _TOMBSTONE:
+                removed.add(key)
+            else:
+                updated[key] = val
+        return updated, removed
+
+    def merge_into(self, target:dict = None) -> dict:
+        """
+        Apply the changes made in the overlay to the target (the parent by default), and returns the target
+        """
+        if target is None: target = self.parent
+        updated, removed = self.changes()
+        for key in removed:
+            target.pop(key, None)
+        target.update(updated)
+        return target
+
+    ## The views + iteration walk the overlay and the parent lazily (in the same order as `copy()`), without flattening them into a dict
+    def keys(self):
+        from collections.abc import KeysView
+        return KeysView(self)
+
+    def values(self):
+        from collections.abc import ValuesView
+        return ValuesView(self)
+
+    def items(self):
+        from collections.abc import ItemsView
+        return ItemsView(self)
+
+    def __iter__(self):
+        for key in self.parent:
+            if dict.__contains__(self, key):
+                if dict.__getitem__(self, key) is _TOMBSTONE: continue
+            yield key
+        for key, val in dict.items(self):
+            if val is not _TOMBSTONE and key not in self.parent:
+                yield key
+
+    def __len__(self) -> int:
+        count = len(self.parent)
+        for key, val in dict.items(self):
+            in_parent = key in self.parent
+            if val is _TOMBSTONE:
+                if in_parent: count -= 1
+            elif not in_parent:
+                count += 1
+        return count
+
+    def __eq__(self, other) -> bool:
+        return self.copy() == (other.copy() if isinstance(other, MetadataOverlay) else other)
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def __or__(self, other) -> dict:
+        flat = self.copy()
+        flat.update(other)
+        return flat
+
+    def __ror__(self, other) -> dict:
+        flat = dict(other)
+        flat.update(self.copy())
+        return flat
+
+    def __ior__(self, other) -> 'MetadataOverlay':
+        self.update(other)
+        return self
+
+    def __copy__(self) -> dict:
+        return self.copy()
+
+    def __deepcopy__(self, memo) -> dict:
+        import copy
+        return copy.deepcopy(self.copy(), memo)
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
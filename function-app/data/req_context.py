@@ -1,6 +1,8 @@
 import os
 import json 
 import base64
+import hmac
+import hashlib
 from typing import Callable
 
 import azure.functions as func
@@ -10,11 +12,39 @@ from aiproxy.history import HistoryProvider
 from aiproxy.streaming import StreamWriter, stream_factory
 from aiproxy.functions import FunctionDef
 
-from subauth import Subscription, get_subscription
+from subauth import Subscription
+
+from .metadata_overlay import MetadataOverlay
+from .config_snapshot import ConfigSnapshot, get_config_snapshot, build_config_snapshot
 
 DEFAULT_CONFIG_NAME = "default"
 GLOBAL_TOKEN_KEYS = None
 
+## The continuation token (see `build_context`) is signed, so its contents can be trusted by subsequent requests
+CONTEXT_TOKEN_VERSION = "2"
+CONTEXT_TOKEN_SIG_BYTES = 16
+## If no key is configured, a per-process key is used - tokens from other instances then only provide their thread
+_CONTEXT_SIGNING_KEY:bytes = os.environ.get("CONTEXT_SIGNING_KEY", "").encode("utf-8") or os.urandom(32)
+
+## The wire format of the ReqContext passed to (+ between) Durable Functions
+DURABLE_PAYLOAD_VERSION = 2
+DURABLE_COMPRESS_MIN_BYTES = int(os.environ.get("DURABLE_COMPRESS_MIN_BYTES", 1024))
+## Only these headers (+ any in the config's `metadata-params` or `durable-headers`) are passed on, the rest are dropped
+DURABLE_HEADER_ALLOWLIST = frozenset([ "config", "x-config", "context", "stream-id", "bot-conversation-id", "content-type", "accept-language", "user-agent" ])
+
+## Bodies are only decoded as JSON if they have one of these content types, or have no (or a generic) content type + look like JSON
+JSON_CONTENT_TYPES = frozenset([ "application/json", "text/json" ])
+SNIFF_CONTENT_TYPES = frozenset([ "", "text/plain", "application/x-www-form-urlencoded" ])
+
+## Groups of request fields that are accepted as aliases of each other (checked in order, the first to be set wins)
+REQ_VAL_ALIASES:dict[str, tuple[str, ...]] = {
+    "thread": ("thread", "thread-id", "conversation", "conversation-id", "conversation_id", "bot-conversation-id"),
+    "assistant": ("assistant", "assistants", "assistant-id", "assistant-name", "assistantid"),
+    "system-prompt": ("system-prompt", "prompt-config", "prompt-file"),
+    "text": ("text", "prompt"),
+    "timeout": ("timeout", "timeout-secs"),
+}
+
 
 class _FakeRequest:
     headers:dict
@@ -48,13 +78,47 @@ class _FakeRequest:
         return self.body
 
 
+def _sign_context(signed:str) -> str:
+    digest = hmac.new(_CONTEXT_SIGNING_KEY, signed.encode("utf-8"), hashlib.sha256).digest()[:CONTEXT_TOKEN_SIG_BYTES]
+    return base64.urlsafe_b64encode(digest).decode("utf-8").rstrip("=")
+
+
+class _lazy:
+    """
+    An attribute that is loaded on first access and then memoised on the instance (it can also be set directly, which skips the loader).
+
+    Similar to `functools.cached_property`, but without its lock - which is shared by all instances, and so would serialise concurrent requests.
+    """
+    def __init__(self, loader:Callable) -> None:
+        self.loader = loader
+        self.name = loader.__name__
+        self.__doc__ = loader.__doc__
+
+    def __set_name__(self, owner, name:str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None: return self
+        val = self.loader(instance)
+        ## The loader may have already set the value itself (eg. when one step loads several values)
+        return instance.__dict__.setdefault(self.name, val)
+
+
+_REQ_INDEX_SOURCES = frozenset([ "req", "body" ])
+
+
 class ReqContext(ChatContext):
+    """
+    The context of a request to the API.
+
+    The values derived from the request (body, config, subscription, thread, stream etc...) are loaded lazily - on first access - and then memoised,
+    so routes that only need a few of them (eg. `who-am-i`) don't pay for the rest. Any of them can also be set directly (eg. when cloning).
+    """
     req: func.HttpRequest = None
-    body:dict = None
-    body_bytes:bytes = None
-    subscription:Subscription = None
-    config:ChatConfig
-    stream_id:str = None
+    orchestrator_name:str = None
+    event_sink:Callable[[any, str], None] = None     ## If set, stream updates are (also) sent to this (eg. to stream them as the HTTP response)
+    _req_index:tuple[dict, dict] = None
+    _identity:tuple[str, str] = None
     
     def __init__(self, req: func.HttpRequest = None, 
                  history_provider:HistoryProvider = None, 
@@ -63,51 +127,223 @@ class ReqContext(ChatContext):
                  ) -> None:
         
         self.req = req
+        if subscription is not None:
+            self.subscription = subscription
         if req is None: return
 
-        ## Body must be parsed first, as it can be used to set other values
-        self.__parse_req_body(req)
+        self._metadata_params_applied = False
+        super().__init__(thread_id=None, history_provider=history_provider, stream=None, function_args_preprocessor=function_args_preprocessor)
 
-        ## Next, Load the Chat Config - as it can also be used to set other values
-        self.__load_chat_config(req)
+        ## The base class assigns the thread + stream up front, so drop those values - they are loaded on first access instead
+        self.__dict__.pop("thread_id", None)
+        self.__dict__.pop("stream_writer", None)
 
-        ## Next, Load the User Information
-        if subscription is None and type(req) == _FakeRequest and req.sub_id is not None:
-            subscription = get_subscription(req.sub_id, False)
-        self.subscription = subscription
-        
-        ## Then, Load the rest of the settings
-        self.__load_stream_id(req)
-        self.__load_bot_conversation_id(req)
-        
-        ## Finally, parse the context variable (if provided) - This must be done last as it can override some of the already loaded settings
-        self.__load_chat_context(req)
-
-        ## If the config has params that need to be added to metadata for saving to history, then add them to the metadata directly here so they can be saved
-        if self.config is not None:
-            mdp = self.config['metadata-params']
-            if mdp is not None and len(mdp) > 0: 
-                for key in mdp:
-                    val = self.get_req_val(key, None)
-                    if val is not None: 
-                        self.set_metadata(key, val, transient=False)
-
-        super().__init__(thread_id=self.thread_id, history_provider=history_provider, stream=self._load_stream_writer(), function_args_preprocessor=function_args_preprocessor)
-    
+    @_lazy
+    def body(self) -> dict:
+        ## Body is parsed once, and is used to set other values
+        return self.__parse_req_body(self.req)
+
+    @_lazy
+    def body_bytes(self) -> bytes:
+        """
+        The raw body of the request (the request's own buffer, it is not copied)
+        """
+        return self.__read_req_body(self.req)
+
+    @_lazy
+    def body_view(self) -> memoryview:
+        """
+        A (zero-copy) view of the raw body of the request, eg. for slicing binary payloads
+        """
+        body_bytes = self.body_bytes
+        return memoryview(body_bytes) if body_bytes is not None else None
+
+    @_lazy
+    def config_name(self) -> str:
+        if self.req is None: return None
+        return self.__load_config_name(self.req) or self.context_data.get("c", None) or DEFAULT_CONFIG_NAME
+
+    @_lazy
+    def config(self) -> ChatConfig:
+        name = self.config_name
+        if name is None: return None
+        config = None
+        ## If the continuation token was issued for the current version of the config, then use its (already loaded) snapshot
+        data = self.context_data
+        if data.get("c", None) == name and data.get("cv", None) is not None:
+            snapshot = get_config_snapshot(name)
+            if snapshot is not None and snapshot.version == data["cv"]:
+                self.config_snapshot = snapshot
+                config = snapshot.config
+        if config is None:
+            from aiproxy.data import ChatConfig
+            config = ChatConfig.load(name)
+        self.__dict__["config"] = config
+        self._apply_metadata_params()
+        return config
+
+    @_lazy
+    def config_snapshot(self) -> ConfigSnapshot:
+        config = self.config
+        if config is None: return None
+        name = self.config_name
+        return get_config_snapshot(name, config) if name is not None else build_config_snapshot(None, config)
+
+    @_lazy
+    def subscription(self) -> Subscription:
+        req = self.req
+        if type(req) == _FakeRequest and req.sub_id is not None:
+            from utils.auth_cache import get_subscription_cached
+            return get_subscription_cached(req.sub_id, False)
+        return None
+
+    @_lazy
+    def stream_id(self) -> str:
+        if self.req is None: return None
+        return self.__load_stream_id(self.req) or self.context_data.get("s", None)
+
+    @_lazy
+    def bot_conversation_id(self) -> str:
+        if self.req is None: return None
+        return self.__load_bot_conversation_id(self.req)
+
+    @_lazy
+    def thread_id(self) -> str:
+        ## The context variable (if provided) overrides any thread provided in the request
+        if self.req is None: return None
+        self.__load_chat_context(self.req)
+        return self.__dict__.get("thread_id", None)
+
+    @_lazy
+    def context_data(self) -> dict:
+        """
+        The (trusted) data from the continuation token provided with the request (empty if there was no token)
+        """
+        if self.req is None: return {}
+        if "thread_id" not in self.__dict__:
+            self.__load_chat_context(self.req)
+        return self.__dict__.get("context_data", {})
+
+    @property
+    def context_orchestrator(self) -> str:
+        """
+        The orchestrator used by the previous turn of the conversation (if the config hasn't changed since)
+        """
+        data = self.context_data
+        if data.get("o", None) is None or data.get("c", None) != self.config_name: return None
+        snapshot = self.config_snapshot
+        if snapshot is None or snapshot.version != data.get("cv", None): return None
+        return data["o"]
+
+    @property
+    def history_cursor(self) -> int:
+        """
+        The number of messages that were in the conversation's history at the end of the previous turn (if known)
+        """
+        return self.context_data.get("hc", None)
+
+    @_lazy
+    def stream_writer(self) -> StreamWriter:
+        if self.req is None: return None
+        return self._load_stream_writer()
+
+    def _apply_metadata_params(self):
+        """
+        If the config has params that need to be added to metadata for saving to history, then add them to the metadata directly so they can be saved
+        """
+        if getattr(self, "_metadata_params_applied", True): return
+        config = self.__dict__.get("config", None)
+        if config is None: return
+        self._metadata_params_applied = True
+        mdp = config['metadata-params']
+        if mdp is not None and len(mdp) > 0: 
+            for key in mdp:
+                val = self.get_req_val(key, None)
+                if val is not None: 
+                    self.set_metadata(key, val, transient=False)
 
     def to_json(self) -> dict:
-        data = {}
-        data["body"] = self.body
-        data["method"] = self.req.method
-        data["headers"] = { k:v for k,v in self.req.headers.items() if self.req.headers is not None }
-        data["params"] = { k:v for k,v in self.req.params.items() }
-        data["route_params"] = { k:v for k,v in self.req.route_params.items() }
-        data["sub_id"] = self.subscription.id if self.subscription is not None else None
-        data["url"] = self.req.url
-        return data
+        """
+        Serialise the context for Durable Functions.
+
+        The request is reduced to what's needed to rebuild the context (allowlisted headers only), along with the already resolved 
+        config, thread, stream + user identity - so they don't need to be resolved again. Large payloads are compressed.
+        """
+        import zlib
+        req = self.req
+        allowed = self.__durable_header_allowlist()
+        data = {
+            "m": req.method,
+            "u": req.url,
+            "h": { k.lower():v for k,v in req.headers.items() if k.lower() in allowed } if req.headers is not None else {},
+            "p": { k:v for k,v in req.params.items() },
+            "r": { k:v for k,v in req.route_params.items() },
+            "b": self.body,
+            "c": self.config_name,
+            "cv": self.config_snapshot.version if self.config_snapshot is not None else None,
+            "t": self.thread_id,
+            "s": self.stream_id,
+            "bc": self.bot_conversation_id,
+            "sub": self.subscription.id if self.subscription is not None else None,
+            "uid": self.user_id,
+            "un": self.user_name,
+        }
+        ## Drop the unset fields
+        data = { k:v for k,v in data.items() if v is not None and v != {} }
+
+        encoded = json.dumps(data, separators=(",", ":"))
+        if len(encoded) >= DURABLE_COMPRESS_MIN_BYTES:
+            compressed = base64.b64encode(zlib.compress(encoded.encode("utf-8"))).decode("ascii")
+            if len(compressed) < len(encoded):
+                return { "v": DURABLE_PAYLOAD_VERSION, "z": compressed }
+        return { "v": DURABLE_PAYLOAD_VERSION, "d": data }
 
     def from_json(data:dict) -> 'ReqContext':
-        return ReqContext(_FakeRequest(data))
+        if type(data) is str: data = json.loads(data)
+        if data.get("v", None) != DURABLE_PAYLOAD_VERSION:
+            ## The original (uncompressed, full request) format
+            return ReqContext(_FakeRequest(data))
+
+        import zlib
+        if "z" in data:
+            data = json.loads(zlib.decompress(base64.b64decode(data["z"])).decode("utf-8"))
+        else:
+            data = data["d"]
+        ctx = ReqContext(_FakeRequest({
+            "method": data.get("m", "POST"),
+            "url": data.get("u", ""),
+            "headers": data.get("h", {}),
+            "params": data.get("p", {}),
+            "route_params": data.get("r", {}),
+            "body": data.get("b", None),
+            "sub_id": data.get("sub", None),
+        }))
+
+        ## Use the already resolved values (rather than resolving them again from the request)
+        ctx.body = data.get("b", None)
+        ctx.thread_id = data.get("t", None)
+        ctx.stream_id = data.get("s", None)
+        ctx.bot_conversation_id = data.get("bc", None)
+        if data.get("c", None) is not None:
+            ctx.config_name = data["c"]
+            ## If the config is still on the same version, then use the (already loaded) snapshot of it
+            snapshot = get_config_snapshot(data["c"]) if data.get("cv", None) is not None else None
+            if snapshot is not None and snapshot.version == data["cv"]:
+                ctx.config_snapshot = snapshot
+                ctx.config = snapshot.config
+                ctx._apply_metadata_params()
+        if data.get("uid", None) is not None or data.get("un", None) is not None:
+            ctx._identity = (data.get("uid", None), data.get("un", None))
+        return ctx
+
+    def __durable_header_allowlist(self) -> frozenset:
+        extra = []
+        for field in ("metadata-params", "durable-headers"):
+            val = self.get_config_value(field, None, fallback_to_env=False)
+            if val is not None:
+                extra.extend(val if type(val) is not str else val.split(","))
+        if len(extra) == 0: return DURABLE_HEADER_ALLOWLIST
+        return DURABLE_HEADER_ALLOWLIST.union(k.strip().lower() for k in extra)
     
 
     @property
@@ -119,6 +355,9 @@ class ReqContext(ChatContext):
 
     @property
     def user_id(self) -> str:
+        if self._identity is not None and "subscription" not in self.__dict__:
+            ## The identity was resolved by a previous stage (eg. before being passed to a Durable Function), so don't load the subscription for it
+            return self._identity[0]
         if self.subscription is None:
             return None
         if self.subscription.is_entra_user:
@@ -129,6 +368,8 @@ class ReqContext(ChatContext):
 
     @property
     def user_name(self) -> str:
+        if self._identity is not None and "subscription" not in self.__dict__:
+            return self._identity[1]
         if self.subscription is None:
             return None
         if self.subscription.is_entra_user and self.subscription.entra_user_claims is not None:
@@ -142,10 +383,13 @@ class ReqContext(ChatContext):
         ctx.req = self.req
         ctx.body = self.body
         ctx.subscription = self.subscription
+        ctx.config_name = self.config_name
         ctx.config = self.config
+        ctx.config_snapshot = self.config_snapshot
         ctx.stream_writer = self.stream_writer if with_streamer else None
-        ctx.metadata = self.metadata.copy() if self.metadata is not None else None
-        ctx.metadata_transient_keys = self.metadata_transient_keys
+        ctx.event_sink = self.event_sink if with_streamer else None
+        ctx.metadata = MetadataOverlay(self.metadata) if self.metadata is not None else None
+        ctx.metadata_transient_keys = self.metadata_transient_keys.copy() if self.metadata_transient_keys is not None else None
         ctx.function_args_preprocessor = self.function_args_preprocessor
         ctx.function_filter = self.function_filter
         return ctx
@@ -155,10 +399,13 @@ class ReqContext(ChatContext):
         ctx.req = self.req
         ctx.body = self.body
         ctx.subscription = self.subscription
+        ctx.config_name = self.config_name
         ctx.config = self.config
+        ctx.config_snapshot = self.config_snapshot
         ctx.stream_writer = self.stream_writer if with_streamer else None
-        ctx.metadata = self.metadata.copy() if self.metadata is not None else None
-        ctx.metadata_transient_keys = self.metadata_transient_keys
+        ctx.event_sink = self.event_sink if with_streamer else None
+        ctx.metadata = MetadataOverlay(self.metadata) if self.metadata is not None else None
+        ctx.metadata_transient_keys = self.metadata_transient_keys.copy() if self.metadata_transient_keys is not None else None
         ctx.function_args_preprocessor = self.function_args_preprocessor
         ctx.function_filter = self.function_filter
         ctx.history_provider = self.history_provider
@@ -168,23 +415,58 @@ class ReqContext(ChatContext):
     def get_req_val(self, field:str, default_val:any = None) -> any:
         """
         Get a value from the body of the request, or return a default value if no value is provided for the field
+
+        Values are looked up in the body, then the query params, then the route params, and finally the headers (case-insensitively)
         """
+        values, headers = self._req_index or self._build_req_index()
+        val = values.get(field, None)
+        if val is None:
+            val = headers.get(field.lower(), None)
+        return val if val is not None else default_val
 
-        val = None
-        if self.body is not None: 
-            val = self.body.get(field, None)
-        if val is None and self.req is not None: 
-            if val is None:
-                val = self.req.params.get(field, None)
-            if val is None:
-                val = self.req.route_params.get(field, None)
-            if val is None:
-                val = self.req.headers.get(field, None)
-            if val is None:
-                val = self.req.headers.get(field.lower(), None)
+    def get_first_req_val(self, fields:str|tuple[str, ...], default_val:any = None) -> any:
+        """
+        Get the first value that is set (ie. not None or empty) from a group of aliased fields, or return a default value if none of them are set
+
+        `fields` is either the list of fields to check (in order) or the name of a group in REQ_VAL_ALIASES (eg. "thread")
+        """
+        if type(fields) is str:
+            fields = REQ_VAL_ALIASES.get(fields, (fields,))
+        values, headers = self._req_index or self._build_req_index()
+        for field in fields:
+            val = values.get(field, None)
             if val is None:
-                val = self.req.headers.get(field.title(), None)
-        return val if val is not None else default_val
+                val = headers.get(field.lower(), None)
+            ## Only None + the empty string count as not set (so eg. `0` or `false` in a JSON body are still used)
+            if val is not None and val != "":
+                return val
+        return default_val
+
+    def _build_req_index(self) -> tuple[dict, dict]:
+        """
+        Build the lookup index of the request values (once per request, it is dropped if the request or body is replaced)
+        """
+        req = self.req
+        body = self.body
+        values = {}
+        headers = {}
+        if req is not None:
+            ## Merge the sources from the lowest to the highest precedence, skipping unset values (so they fall through to the next source)
+            for source in (req.route_params, req.params):
+                if source is not None:
+                    values.update({ k:v for k,v in source.items() if v is not None })
+            if req.headers is not None:
+                headers = { k.lower():v for k,v in req.headers.items() if v is not None }
+        if type(body) is dict:
+            values.update({ k:v for k,v in body.items() if v is not None })
+
+        self._req_index = (values, headers)
+        return self._req_index
+
+    def __setattr__(self, name:str, value:any):
+        if name in _REQ_INDEX_SOURCES:
+            self.__dict__.pop("_req_index", None)
+        super().__setattr__(name, value)
 
     def has_config(self, config_field:str=None) -> bool:
         """
@@ -199,59 +481,89 @@ class ReqContext(ChatContext):
         """
         Returns the config value as set in the config, otherwise, returns the default value (if no value is set in the config)
         """
-        if not self.config: return default_value
-        val = None
-        if config_field in self.config:
-            val = self.config[config_field]
-        if  val is None:
-            val = os.environ.get(config_field.upper(), None) if fallback_to_env else None
-        return val if val is not None else default_value
+        snapshot = self.config_snapshot
+        if snapshot is None: return default_value
+        return snapshot.get(config_field, default_value, fallback_to_env)
 
     def build_context(self)->str:
         """
         Build a context string that can be provided by subsequent requests to this API to maintain a conversation's context (thread).
 
-        The context string is a base64 encoded JSON object containing the contextual data needed to continue the conversation
+        The context string is a versioned, signed token: `<version>.<base64 encoded JSON of the contextual data>.<signature>`
+        Along with the thread, it holds the config (+ its version), orchestrator, history position + stream used, so the next turn doesn't need to resolve them again
         """
         data = dict()
         if self.thread_id is not None:
             data['t'] = self.thread_id
-        
-        ## TODO: Add any additional context that might be needed 
-        return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("utf-8")
+        if self.config_name is not None:
+            data['c'] = self.config_name
+            if self.config_snapshot is not None:
+                data['cv'] = self.config_snapshot.version
+        if self.orchestrator_name is not None:
+            data['o'] = self.orchestrator_name
+        history = getattr(self, "history", None)
+        if history is not None:
+            data['hc'] = len(history)
+        if self.stream_id is not None:
+            data['s'] = self.stream_id
+
+        payload = base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).decode("utf-8").rstrip("=")
+        signed = CONTEXT_TOKEN_VERSION + "." + payload
+        return signed + "." + _sign_context(signed)
 
     def _unpack_context(self, context:str):
         """
         Unpacks the request context string (if provided) and sets the contextual data needed to continue an already active conversation
         """
         
-        # Context is assumed to have been packed by the `build_context` method, essentially a b64 encoded json of the contextual data
+        # Context is assumed to have been packed by the `build_context` method
         if context is None or len(context) == 0:
             ## Obviously, we need a better way of enabling conversastions to be re-joined - this is just a placeholder
-            self.thread_id = self.get_req_val("thread") or self.get_req_val("thread-id") or self.get_req_val("conversation") or self.get_req_val("conversation-id") or self.get_req_val("conversation_id") or self.get_req_val("bot-conversation-id")
+            self.thread_id = self.get_first_req_val("thread")
             if self.thread_id is not None and self.thread_id.lower() in [ "undefined", "none", "null", "new", ""]:
                 self.thread_id = None
-        else:  
+            self.context_data = {}
+            return
+
+        parts = context.split(".")
+        if len(parts) == 3 and parts[0] == CONTEXT_TOKEN_VERSION:
+            data = json.loads(base64.urlsafe_b64decode((parts[1] + '==').encode("utf-8")))
+            if not hmac.compare_digest(parts[2], _sign_context(parts[0] + "." + parts[1])):
+                ## Not signed by this app (or signed with another key), so only the thread is used (as per the original, unsigned, tokens)
+                data = { 't': data.get('t', None) }
+        else:
+            ## The original format, essentially a b64 encoded json of the contextual data (which only ever held the thread)
             padded_context = context + '=='
             unpacked = base64.urlsafe_b64decode(padded_context.encode("utf-8"))
             data = json.loads(unpacked)
-            self.thread_id = data.get('t',None)
-
-    def __parse_req_body(self, req: func.HttpRequest):
-         ## Grab the JSON body (if there is one)
-        if req.method == "POST" or req.method == "PUT": 
-            try: 
-                self.body = req.get_json()
-            except ValueError: 
-                self.body = None ## If the body isn't JSON, ignore it
-
-            try:
-                self.body_bytes = req.get_body()
-            except Exception: 
-                self.body_bytes = None
-        else: 
-            self.body = None
-            self.noddy_bytes = None
+            data = { 't': data.get('t', None) }
+        self.thread_id = data.get('t',None)
+        self.context_data = data
+
+    def __read_req_body(self, req: func.HttpRequest) -> bytes:
+        if req is None or (req.method != "POST" and req.method != "PUT"): return None
+        try:
+            return req.get_body()
+        except Exception: 
+            return None
+
+    def __parse_req_body(self, req: func.HttpRequest) -> dict:
+        ## Grab the JSON body (if there is one)
+        if req is None or (req.method != "POST" and req.method != "PUT"): return None
+        if type(req) == _FakeRequest: return req.get_json()
+
+        ## Only decode the body if the content type says it's JSON (or there's no content type + it looks like JSON)
+        content_type = (req.headers.get("content-type", None) or "").split(";")[0].strip().lower()
+        is_json = content_type in JSON_CONTENT_TYPES or content_type.endswith("+json")
+        if not is_json and content_type not in SNIFF_CONTENT_TYPES: return None
+
+        body_bytes = self.body_bytes
+        if body_bytes is None or len(body_bytes) == 0: return None
+        if not is_json and body_bytes[:64].lstrip()[:1] not in (b"{", b"["): return None
+        try: 
+            return json.loads(body_bytes)
+        except ValueError: 
+            return None ## If the body isn't JSON, ignore it
 
     def __load_chat_context(self, req: func.HttpRequest):
         """
@@ -267,7 +579,7 @@ class ReqContext(ChatContext):
         context = next((ctx for ctx in context_sources if ctx and len(ctx) > 3), None)
         self._unpack_context(context)
     
-    def __load_stream_id(self, req: func.HttpRequest):
+    def __load_stream_id(self, req: func.HttpRequest) -> str:
         """
         Loads the Stream ID from the request headers, body, or query parameters
         """
@@ -276,10 +588,9 @@ class ReqContext(ChatContext):
             self.body.get("stream-id", None) if self.body else None,
             req.params.get("stream-id", None),
         ]
-        val = next((key for key in sources if key is not None), None)
-        self.stream_id = val
+        return next((key for key in sources if key is not None), None)
     
-    def __load_bot_conversation_id(self, req: func.HttpRequest):
+    def __load_bot_conversation_id(self, req: func.HttpRequest) -> str:
         """
         Loads the BotFramework Conversation ID from the request headers, body, or query parameters
         """
@@ -288,24 +599,19 @@ class ReqContext(ChatContext):
             self.body.get("bot-conversation-id", None) if self.body else None,
             req.params.get("bot-conversation-id", None),
         ]
-        val = next((key for key in sources if key is not None), None)
-        self.bot_conversation_id = val
+        return next((key for key in sources if key is not None), None)
     
-    def __load_chat_config(self, req: func.HttpRequest):
+    def __load_config_name(self, req: func.HttpRequest) -> str:
         """
-        Loads the Chat Config from the request headers, body, or query parameters
+        Loads the name of the Chat Config from the request headers, body, or query parameters
         """
         sources = [
             req.headers.get("config", None),
             req.headers.get("x-config", None),
             req.params.get("config", None),
             self.body.get("config", None) if self.body else None,
-            DEFAULT_CONFIG_NAME ## Default Config
         ]
-        val = next((key for key in sources if key is not None and len(key.strip()) > 2), None)
-        if val is not None: 
-            from aiproxy.data import ChatConfig
-            self.config = ChatConfig.load(val)
+        return next((key for key in sources if key is not None and len(key.strip()) > 2), None)
 
     def _load_stream_writer(self) -> StreamWriter: 
         ## Initialize the Stream
@@ -318,6 +624,19 @@ class ReqContext(ChatContext):
         if stream_type is None: return None
         return stream_factory(stream_type, stream_id=self.bot_conversation_id or self.stream_id or self.thread_id, stream_config=self.get_config_value("stream-config", None))
 
+    def has_stream(self) -> bool:
+        ## Updates are wanted if there is an event sink (eg. a streamed response), even without a stream to push them to
+        return self.event_sink is not None or super().has_stream()
+
+    def push_stream_update(self, update:any, event_type:str = None, *args, **kwargs):
+        sink = self.event_sink
+        if sink is not None:
+            sink(update, event_type)
+            if self.stream_writer is None: return
+        if event_type is None:
+            return super().push_stream_update(update, *args, **kwargs)
+        return super().push_stream_update(update, event_type, *args, **kwargs)
+
     def get_metadata(self, key: str, default: any = None) -> any:
         val = self.get_req_val(key, None)
         if val is None and (key == 'bytes' or key == 'body' or key == 'body-bytes' or key == 'image-bytes'):
@@ -333,6 +652,8 @@ class ReqContext(ChatContext):
         return super().parse_prompt_key(key)
     
     def add_message_to_history(self, message:ChatMessage):
+        ## Make sure the config (+ so the metadata params) is loaded before anything is saved to the history
+        _ = self.config
         message.add_metadata("_user_id", self.user_id)
         message.add_metadata("_user_name", self.user_name)
         super().add_message_to_history(message)
\ No newline at end of file
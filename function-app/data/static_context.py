@@ -0,0 +1,39 @@
+import azure.functions as func
+
+from aiproxy.data import ChatConfig
+from subauth import Subscription
+
+from .config_snapshot import ConfigSnapshot, get_config_snapshot
+from .req_context import DEFAULT_CONFIG_NAME
+
+class StaticContext:
+    """
+    A lightweight context for requests that only need a few config values (eg. serving the UI's static assets).
+
+    Unlike the ReqContext, it doesn't parse the body, setup streams, history or any other chat related state - it only resolves the config.
+    """
+    req:func.HttpRequest = None
+    subscription:Subscription = None
+    config:ChatConfig = None
+    config_snapshot:ConfigSnapshot = None
+
+    def __init__(self, req:func.HttpRequest = None, subscription:Subscription = None, config_name:str = None) -> None:
+        self.req = req
+        self.subscription = subscription
+
+        if config_name is None and req is not None:
+            sources = [
+                req.headers.get("config", None),
+                req.headers.get("x-config", None),
+                req.params.get("config", None),
+            ]
+            config_name = next((key for key in sources if key is not None and len(key.strip()) > 2), None)
+        self.config_snapshot = get_config_snapshot(config_name or DEFAULT_CONFIG_NAME)
+        self.config = self.config_snapshot.config if self.config_snapshot is not None else None
+
+    def get_config_value(self, config_field:str, default_value:any = None, fallback_to_env:bool = True) -> any:
+        """
+        Returns the config value as set in the config, otherwise, returns the default value (if no value is set in the config)
+        """
+        if self.config_snapshot is None: return default_value
+        return self.config_snapshot.get(config_field, default_value, fallback_to_env)
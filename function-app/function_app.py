@@ -2,6 +2,14 @@ import azure.functions as func
 import azure.durable_functions as df
 
 import logging
+import os
+
+## HTTP streaming (used by the */stream routes) needs the FastAPI extension, the routes are only registered if it's installed
+try:
+    from azurefunctions.extensions.http.fastapi import Request as StreamingRequest, StreamingResponse
+except ImportError:
+    StreamingRequest = None
+    StreamingResponse = None
 
 app = df.DFApp(http_auth_level=func.AuthLevel.FUNCTION)
 # app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
@@ -54,9 +62,44 @@ def setup_app():
     ## Load the Publish Orchestrator List
     build_public_orchestrator_list()
 
+    ## Build the UI asset manifest (in the background, so as not to hold up the first request)
+    import threading
+    if os.environ.get("UI_MANIFEST_ENABLED", "true").lower() in ['true', 'yes', '1']:
+        threading.Thread(target=init_ui_manifest, daemon=True).start()
+
+    ## Then keep the manifest + the cached UI assets of this instance up to date
+    from utils.asset_manifest import DEFAULT_UI_ASSET_POLL_SECS
+    ui_poll_secs = float(os.environ.get("UI_ASSET_POLL_SECS", DEFAULT_UI_ASSET_POLL_SECS))
+    if ui_poll_secs > 0:
+        threading.Thread(target=poll_ui_assets, args=[ui_poll_secs], daemon=True).start()
+
+    ## Without a shared key, each instance signs the continuation tokens with its own (random) key - so a token is only fully trusted by the instance that issued it
+    if not os.environ.get("CONTEXT_SIGNING_KEY", None):
+        logging.warning("CONTEXT_SIGNING_KEY is not set, using a per-instance key - continuation tokens issued by other instances (or before a restart) will only carry their thread")
+
     logging.warning('App setup and ready to go!')
 
 
+def build_default_context():
+    """
+    Build a context (without a request) that uses the default config, for use by background tasks
+    """
+    from data import StaticContext
+    return StaticContext()
+
+
+def init_ui_manifest():
+    from utils.asset_manifest import refresh_ui_manifest, prefetch_ui_assets
+    try: 
+        context = build_default_context()
+        refresh_ui_manifest(context)
+        prefetch_ui_assets(context)
+    except ValueError as e:
+        logging.info(f"UI asset manifest not built (UI storage is not configured): {e}")
+    except Exception as e:
+        logging.error(f"Error building UI asset manifest: {e}")
+
+
 def ensure_app_setup():
     global APP_SETUP
     if not APP_SETUP:
@@ -71,6 +114,7 @@ def refresh_config_cache(tm: func.TimerRequest) -> None:
 
     ## Refresh the configs in the config cache (every 20s)
     from aiproxy.utils.config import CACHED_CONFIGS, load_named_config
+    from data.config_snapshot import refresh_config_snapshots
     try: 
         for k in CACHED_CONFIGS.keys():
             updated_val = load_named_config(k, False, False)
@@ -80,6 +124,15 @@ def refresh_config_cache(tm: func.TimerRequest) -> None:
         ## Refresh the Orchestrator list
         build_public_orchestrator_list()
 
+        ## Only reset the Orchestrators, Agents + Proxies if the content of a config has changed (a new version of its snapshot)
+        changed = refresh_config_snapshots()
+        if len(changed) == 0: return
+        logging.info(f"Configs changed: {changed}")
+
+        ## Drop the pooled Orchestrators built from the changed configs
+        from utils.orchestrator_cache import GLOBAL_ORCHESTRATOR_POOL
+        GLOBAL_ORCHESTRATOR_POOL.invalidate(changed)
+
         ## Update the configs in each of the Orchestrators, Agents + Proxies
         from aiproxy import GLOBAL_PROXIES_REGISTRY
         GLOBAL_PROXIES_REGISTRY.reset()
@@ -90,19 +143,100 @@ def refresh_config_cache(tm: func.TimerRequest) -> None:
     except Exception as e:
         print(f"Error refreshing cache: {e}")
 
+def poll_ui_assets(interval_secs:float):
+    ## Poll the UI assets for changes, refreshing the manifest + evicting only the cached assets that have changed
+    ## Every instance polls for itself (as the manifest + asset cache are per-process, whereas a timer trigger only runs on one instance)
+    import time
+    from utils.asset_manifest import refresh_ui_assets
+    while True:
+        time.sleep(interval_secs)
+        try: 
+            refresh_ui_assets(build_default_context())
+        except Exception as e:
+            logging.warning(f"Error refreshing UI assets: {e}")
+
+def validate_request(req: func.HttpRequest, **kwargs) -> tuple:
+    """
+    Check the limits of the request (eg. the size of its body), then validate it (with the cached auth decision for its credential).
+
+    Returns the same (valid, subscription, login_resp) tuple as `validate_function_request`, with the 413 response as the login response if the request is too large
+    """
+    from utils.auth_cache import validate_function_request_cached
+    from utils.request_limits import check_request_body_size
+
+    too_large = check_request_body_size(req)
+    if too_large is not None:
+        return False, None, too_large
+    return validate_function_request_cached(req, **kwargs)
+
+
+def resolve_orchestrator(context):
+    """
+    Resolve (+ load) the Orchestrator to use for the request
+    """
+    from utils.orchestrator_cache import load_orchestrator
+
+    ## Use the orchestrator from the previous turn of the conversation (as per the continuation token) unless the request specifies one
+    orchestrator_name = context.get_req_val("orchestrator", None) or context.context_orchestrator or context.get_config_value("orchestrator", None)
+    if orchestrator_name is None: 
+        orchestrator_name = context.get_config_value("default-orchestrator", "completion")
+    context.orchestrator_name = orchestrator_name
+
+    ## Load the Orchestrator/Proxy (from its cached config)
+    return load_orchestrator(orchestrator_name, context, 'completion')
+
+
+def resolve_completion_proxy(context):
+    """
+    Load the Completions Proxy to use for the request
+    """
+    from aiproxy import CompletionsProxy, GLOBAL_PROXIES_REGISTRY
+    return GLOBAL_PROXIES_REGISTRY.load_proxy(context.config['default-completion-proxy'], CompletionsProxy)
+
+
+def prepare_prompt(context, resolve_proxy) -> tuple:
+    """
+    Resolve the proxy for the request, and the request specific system prompt (if there is one) - both can load configs, so this is blocking
+    """
+    proxy = resolve_proxy(context)
+    return proxy, determine_override_system_prompt(context)
+
+
+def send_prompt(proxy, prompt:str, context, push_complete:bool = True, **kwargs) -> tuple:
+    """
+    Send the prompt to the proxy (blocking, loading + saving the history of the conversation), returns the response and its API representation
+    """
+    from utils.orchestrator_cache import release_orchestrator
+    try:
+        context.init_history()  ## Ensure that the history for this conversation has been loaded
+        resp = proxy.send_message(prompt, context, **kwargs)
+    finally:
+        ## The turn is done with the Orchestrator, so it can be used by the next one
+        release_orchestrator(proxy)
+
+    api_resp = resp.to_api_response()
+    if push_complete and not resp.error:
+        ## Send a "complete" message to the stream
+        context.push_stream_update({
+            "id": resp.id, 
+            "data": api_resp
+        }, "complete")
+    return resp, api_resp
+
+
 @app.route(route="chat", methods=["POST", "GET"])
-def chat(req: func.HttpRequest) -> func.HttpResponse:
+async def chat(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     global GLOBAL_HISTORY_PROVIDER
 
     import json
-    from aiproxy.orchestration import orchestrator_factory
-    from aiproxy.data import ChatConfig
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
+    from utils.workers import run_blocking
+    from utils.rate_limit import admit_request, rate_limited_response
+    from utils.orchestrator_cache import release_orchestrator
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = await run_blocking(validate_request, req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -114,33 +248,14 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
     if prompt is None: 
         raise ValueError("No prompt specified")
 
-    ## Check if there is a request specific system prompt to use
-    override_system_prompt = determine_override_system_prompt(context)
-
     ## Grab Other Request Specific Settings
     use_functions = context.get_req_val("use-functions", 'true').lower() in ['true', 'yes', '1']
-    timeout_secs = int(context.get_req_val("timeout", context.get_req_val("timeout-secs", "90")))
+    timeout_secs = int(context.get_first_req_val("timeout", "90"))
 
-    ## Load the Orchestrator / Proxy to use for this request
+    ## Load the Orchestrator / Proxy to use for this request (+ check if there is a request specific system prompt to use)
     proxy = None
     try: 
-        orchestrator_config = None
-        orchestrator_name = None
-        orchestrator_name = context.get_req_val("orchestrator", context.get_config_value("orchestrator", None))
-        if orchestrator_name is None: 
-            orchestrator_name = context.get_config_value("default-orchestrator", "completion")
-            orchestrator_config = ChatConfig.load(orchestrator_name, False)
-        else: 
-            orchestrator_config = ChatConfig.load(orchestrator_name, False)
-
-        if orchestrator_config is None: 
-            ## Create a default Config
-            orchestrator_config = context.config.clone()
-            orchestrator_config['type'] = context.get_req_val("orchestrator-type", context.get_config_value("orchestrator-type", 'completion'))
-            orchestrator_config['name'] = orchestrator_name
-            
-        ## Load the Orchestrator/Proxy and send the message
-        proxy = orchestrator_factory(orchestrator_config)
+        proxy, override_system_prompt = await run_blocking(prepare_prompt, context, resolve_orchestrator)
     except Exception as e: 
         if 'unknown orchestrator' in str(e).lower():
             return func.HttpResponse(
@@ -152,17 +267,13 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
         else:  
             raise e
 
-    
-    context.init_history()  ## Ensure that the history for this conversation has been loaded
-    resp = proxy.send_message(prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs)
+    ## Hold back (briefly) or reject the request if its subscription is over its token rate limit
+    retry_after = await admit_request(context, prompt, override_system_prompt)
+    if retry_after is not None:
+        release_orchestrator(proxy)
+        return rate_limited_response(retry_after)
 
-    api_resp = resp.to_api_response()
-    if not resp.error:
-        ## Send a "complete" message to the stream
-        context.push_stream_update({
-            "id": resp.id, 
-            "data": api_resp
-        }, "complete")
+    resp, api_resp = await run_blocking(send_prompt, proxy, prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs)
 
     response = func.HttpResponse(
         body=json.dumps({
@@ -180,41 +291,57 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
     return response
 
 @app.route(route="completion", methods=["POST", "GET"])
-def chat_completion(req: func.HttpRequest) -> func.HttpResponse:
+async def chat_completion(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     global GLOBAL_HISTORY_PROVIDER
 
     import json
-    from aiproxy import CompletionsProxy, GLOBAL_PROXIES_REGISTRY
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
+    from utils.workers import run_blocking
+    from utils.response_cache import GLOBAL_COMPLETION_CACHE, lookup_completion, completion_cache_ttl, is_cacheable_request
+    from utils.single_flight import GLOBAL_COMPLETION_FLIGHTS, is_single_flight_enabled, completion_flight_key
+    from utils.rate_limit import admit_request, rate_limited_response
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = await run_blocking(validate_request, req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
 
     context = ReqContext(req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
-    
-    proxy = GLOBAL_PROXIES_REGISTRY.load_proxy(context.config['default-completion-proxy'], CompletionsProxy)
 
     prompt = context.get_req_val("prompt", None)
     if prompt is None: 
         raise ValueError("No prompt specified")
     
-    ## Check if there is a request specific system prompt to use
-    override_system_prompt = determine_override_system_prompt(context)
+    ## Load the Proxy (+ check if there is a request specific system prompt to use)
+    proxy, override_system_prompt = await run_blocking(prepare_prompt, context, resolve_completion_proxy)
 
     ## Grab Other Request Specific Settings
     use_functions = context.get_req_val("use-functions", 'true').lower() in ['true', 'yes', '1']
-    timeout_secs = int(context.get_req_val("timeout", context.get_req_val("timeout-secs", "90")))
+    timeout_secs = int(context.get_first_req_val("timeout", "90"))
+
+    ## Serve repeated (thread-less) prompts from the response cache, if the config opts in to it
+    cache_key, api_resp, cache_status = lookup_completion(context, prompt, override_system_prompt, use_functions)
+    if api_resp is None:
+        ## Hold back (briefly) or reject the request if its subscription is over its token rate limit
+        retry_after = await admit_request(context, prompt, override_system_prompt)
+        if retry_after is not None:
+            return rate_limited_response(retry_after)
+
+        shared = False
+        if is_cacheable_request(context) and is_single_flight_enabled(context):
+            ## Identical (thread-less) requests from the same subscriber that are in flight at the same time share a single call to the proxy
+            flight_key = completion_flight_key(context, prompt, override_system_prompt, use_functions, cache_key)
+            (resp, api_resp), shared = await GLOBAL_COMPLETION_FLIGHTS.do_async(flight_key, run_blocking, send_prompt, proxy, prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs, push_complete=False)
+        else:
+            resp, api_resp = await run_blocking(send_prompt, proxy, prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs, push_complete=False)
+        if cache_key is not None and not shared and not resp.error:
+            GLOBAL_COMPLETION_CACHE.put(cache_key, api_resp, completion_cache_ttl(context))
 
-    context.init_history()  ## Ensure that the history for this conversation has been loaded
-    resp = proxy.send_message(prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs)
     response = func.HttpResponse(
         body=json.dumps({
-            "response": resp.to_api_response(), 
+            "response": api_resp, 
             "context": context.build_context()
         }, indent=4),
         status_code=200, 
@@ -222,22 +349,267 @@ def chat_completion(req: func.HttpRequest) -> func.HttpResponse:
             "content-type": "application/json",
         }
     )
+    if cache_status is not None:
+        response.headers["x-cache"] = cache_status
+    ## Add the headers from the login response
+    if login_resp is not None and login_resp.status_code == 0:
+        response.headers.extend(login_resp.headers)
+    return response
+
+
+if StreamingRequest is not None:
+    @app.route(route="chat/stream", methods=["POST", "GET"])
+    async def chat_stream(req: StreamingRequest) -> StreamingResponse:
+        ## As per /chat, but the response is streamed as Server-Sent Events (the same updates as are pushed to a stream, then the `complete` envelope)
+        return await stream_prompt_response(req, resolve_orchestrator)
+
+    @app.route(route="completion/stream", methods=["POST", "GET"])
+    async def chat_completion_stream(req: StreamingRequest) -> StreamingResponse:
+        ## As per /completion, but the response is streamed as Server-Sent Events
+        return await stream_prompt_response(req, resolve_completion_proxy)
+
+
+async def stream_prompt_response(req, resolve_proxy):
+    """
+    Send the prompt of the request to the proxy resolved for it, streaming the updates (+ the final response) back as Server-Sent Events
+    """
+    ensure_app_setup()
+    global GLOBAL_HISTORY_PROVIDER
+
+    from data import ReqContext
+    from utils.sse import EventQueue, SSE_HEADERS, to_func_request, to_streaming_route_response
+    from utils.workers import run_blocking, submit_blocking
+    from utils.rate_limit import admit_request, rate_limited_response
+    from utils.orchestrator_cache import release_orchestrator
+
+    ## Validate the Request
+    func_req = await to_func_request(req)
+    valid, subscription, login_resp = await run_blocking(validate_request, func_req, default_fail_status=401)
+    if not valid: 
+        login_resp.headers["x-path"] = func_req.url
+        return to_streaming_route_response(login_resp)
+
+    context = ReqContext(func_req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
+
+    prompt = context.get_req_val("prompt", None)
+    if prompt is None: 
+        return to_streaming_route_response(func.HttpResponse(status_code=400, headers={ "reason": "No prompt specified" }))
+
+    try: 
+        proxy, override_system_prompt = await run_blocking(prepare_prompt, context, resolve_proxy)
+    except Exception as e: 
+        if 'unknown orchestrator' in str(e).lower():
+            return to_streaming_route_response(func.HttpResponse(status_code=400, headers={ "reason": "Orchestrator Not Found" }))
+        raise e
+
+    ## Hold back (briefly) or reject the request if its subscription is over its token rate limit
+    retry_after = await admit_request(context, prompt, override_system_prompt)
+    if retry_after is not None:
+        release_orchestrator(proxy)
+        return to_streaming_route_response(rate_limited_response(retry_after))
+
+    ## Grab Other Request Specific Settings
+    use_functions = context.get_req_val("use-functions", 'true').lower() in ['true', 'yes', '1']
+    timeout_secs = int(context.get_first_req_val("timeout", "90"))
+
+    ## Send the stream updates to the response (as well as to the stream, if one has been requested)
+    events = EventQueue()
+    context.event_sink = events.push
+
+    def send_and_close():
+        try: 
+            ## Sends the "complete" message to the stream (+ the response)
+            resp, api_resp = send_prompt(proxy, prompt, context, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs)
+            if resp.error:
+                events.push({ "id": resp.id, "data": api_resp }, "error")
+            events.push({ "context": context.build_context() }, "context")
+        except Exception as e:
+            logging.exception("Error whilst streaming the response to a prompt")
+            events.push({ "error": str(e) }, "error")
+        finally:
+            events.close()
+
+    ## The proxies are synchronous, so send the prompt on a worker thread whilst the events are streamed back
+    submit_blocking(send_and_close)
+
+    headers = dict(SSE_HEADERS)
+    ## Add the headers from the login response
+    if login_resp is not None and login_resp.status_code == 0:
+        headers.update({ k:v for k,v in login_resp.headers.items() })
+    return StreamingResponse(events.events(), headers=headers, media_type="text/event-stream")
+
+
+@app.route(route="chat/batch", methods=["POST"])
+async def chat_batch(req: func.HttpRequest) -> func.HttpResponse:
+    ensure_app_setup()
+
+    import json
+    from utils.workers import run_blocking
+
+    ## Validate the Request (once for the whole batch)
+    valid, subscription, login_resp = await run_blocking(validate_request, req, default_fail_status=401)
+    if not valid: 
+        login_resp.headers["x-path"] = req.route_params.get("path", req.url)
+        return login_resp
+
+    context, items, error_resp = await prepare_batch(req, subscription)
+    if error_resp is not None:
+        return error_resp
+
+    ## Collect the results (in the order of the prompts)
+    results = [ None ] * len(items)
+    async for idx, result in run_batch(context, items):
+        results[idx] = result
+
+    response = func.HttpResponse(
+        body=json.dumps({
+            "responses": results
+        }, indent=4),
+        status_code=200, 
+        headers={
+            "content-type": "application/json",
+        }
+    )
     ## Add the headers from the login response
     if login_resp is not None and login_resp.status_code == 0:
         response.headers.extend(login_resp.headers)
     return response
 
 
+if StreamingRequest is not None:
+    @app.route(route="chat/batch/stream", methods=["POST"])
+    async def chat_batch_stream(req: StreamingRequest) -> StreamingResponse:
+        ## As per /chat/batch, but each result is streamed back (as a line of NDJSON) as soon as it completes
+        ensure_app_setup()
+
+        import json
+        from utils.sse import to_func_request, to_streaming_route_response
+        from utils.workers import run_blocking
+
+        ## Validate the Request (once for the whole batch)
+        func_req = await to_func_request(req)
+        valid, subscription, login_resp = await run_blocking(validate_request, func_req, default_fail_status=401)
+        if not valid: 
+            login_resp.headers["x-path"] = func_req.url
+            return to_streaming_route_response(login_resp)
+
+        context, items, error_resp = await prepare_batch(func_req, subscription)
+        if error_resp is not None:
+            return to_streaming_route_response(error_resp)
+
+        async def lines():
+            async for _, result in run_batch(context, items):
+                yield json.dumps(result) + "\n"
+
+        headers = { "cache-control": "no-cache", "x-accel-buffering": "no" }
+        ## Add the headers from the login response
+        if login_resp is not None and login_resp.status_code == 0:
+            headers.update({ k:v for k,v in login_resp.headers.items() })
+        return StreamingResponse(lines(), headers=headers, media_type="application/x-ndjson")
+
+
+async def prepare_batch(req: func.HttpRequest, subscription) -> tuple:
+    """
+    Build the (shared) context of a batch request + parse its items, returns the (context, items, error response)
+    """
+    global GLOBAL_HISTORY_PROVIDER
+    from data import ReqContext
+    from utils.batch import parse_batch_items, batch_max_items
+    from utils.workers import run_blocking
+
+    context = ReqContext(req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
+    try: 
+        items = parse_batch_items(context.body)
+    except ValueError as e:
+        return None, None, func.HttpResponse(status_code=400, headers={ "reason": str(e) })
+
+    ## Load the config once, for all of the items
+    await run_blocking(lambda: context.config)
+    if len(items) > batch_max_items(context):
+        return None, None, func.HttpResponse(status_code=413, headers={ "reason": f"Too many prompts (max {batch_max_items(context)})" })
+    return context, items, None
+
+
+async def run_batch(context, items:list[dict]):
+    """
+    Send the items of a batch concurrently (limited per subscription), yielding the (index, result) of each item as it completes
+    """
+    import math
+    import asyncio
+    from utils.batch import subscription_slot, batch_max_concurrency
+    from utils.workers import run_blocking
+    from utils.rate_limit import admit_tokens
+    from utils.orchestrator_cache import release_orchestrator
+
+    ## The completions proxy is used for all items when `mode` is "completion", otherwise each item is sent to its orchestrator
+    resolve_proxy = resolve_completion_proxy if context.get_req_val("mode", "chat") == "completion" else resolve_orchestrator
+    slot_key = context.user_id or "anonymous"
+    limit = batch_max_concurrency(context)
+
+    async def run_item(idx:int, item:dict) -> tuple:
+        async with subscription_slot(slot_key, limit):
+            try: 
+                item_context, proxy, override_system_prompt, tokens = await run_blocking(prepare_batch_item, context, item, resolve_proxy)
+                ## Each item is charged to the rate limit of the subscription (as if it had been sent on its own)
+                retry_after = await admit_tokens(item_context, tokens)
+                if retry_after is not None:
+                    release_orchestrator(proxy)
+                    result = { "error": "Rate Limit Exceeded", "retry-after": max(1, math.ceil(retry_after)) }
+                else: 
+                    result = await run_blocking(send_batch_item, item_context, item, proxy, override_system_prompt)
+            except Exception as e:
+                logging.warning(f"Error sending item {idx} of a batch: {e}")
+                result = { "error": str(e) }
+        return idx, { "index": idx, **result }
+
+    for next_done in asyncio.as_completed([ run_item(idx, item) for idx, item in enumerate(items) ]):
+        yield await next_done
+
+
+def prepare_batch_item(context, item:dict, resolve_proxy) -> tuple:
+    """
+    Prepare a single item of a batch (blocking), in a context of its own that shares the auth + config of the batch.
+
+    Returns the (item context, proxy, override system prompt, estimated tokens of the request) - estimated as per a request sent on its own, incl. its system prompt + history
+    """
+    from utils.rate_limit import estimate_request_tokens, resolve_rate_limit
+
+    item_context = context.clone_for_thread_isolation(item.get("thread", None))
+    ## The fields of the item override those of the batch request
+    item_context.body = { **{ k:v for k,v in (context.body or {}).items() if k not in ("prompts", "items") }, **item }
+
+    proxy, override_system_prompt = prepare_prompt(item_context, resolve_proxy)
+    ## Only estimated if the subscription is limited (as the estimate can load the history of the conversation)
+    tokens = estimate_request_tokens(item_context, item["prompt"], override_system_prompt) if resolve_rate_limit(item_context) is not None else 0
+    return item_context, proxy, override_system_prompt, tokens
+
+
+def send_batch_item(item_context, item:dict, proxy, override_system_prompt:str) -> dict:
+    """
+    Send a single (prepared) item of a batch (blocking)
+    """
+    use_functions = str(item_context.get_req_val("use-functions", 'true')).lower() in ['true', 'yes', '1']
+    timeout_secs = int(item_context.get_first_req_val("timeout", "90"))
+    resp, api_resp = send_prompt(proxy, item["prompt"], item_context, push_complete=False, override_system_prompt=override_system_prompt, use_functions=use_functions, timeout_secs=timeout_secs)
+    return {
+        "response": api_resp,
+        "context": item_context.build_context(),
+    }
+
+
 @app.route(route="refresh-caches", methods=["POST", "GET"])
 def refresh_caches(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     from aiproxy.utils.config import CACHED_CONFIGS
     from aiproxy import GLOBAL_PROXIES_REGISTRY
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
+    from data.config_snapshot import reset_config_snapshots
+    from utils.auth_cache import GLOBAL_AUTH_CACHE
+    from utils.orchestrator_cache import GLOBAL_ORCHESTRATOR_POOL
+    from utils.response_cache import GLOBAL_COMPLETION_CACHE
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -255,6 +627,10 @@ def refresh_caches(req: func.HttpRequest) -> func.HttpResponse:
     
     CACHED_CONFIGS.clear()
     GLOBAL_PROXIES_REGISTRY._proxies.clear()
+    reset_config_snapshots()
+    GLOBAL_AUTH_CACHE.purge()
+    GLOBAL_ORCHESTRATOR_POOL.purge()
+    GLOBAL_COMPLETION_CACHE.purge()
     
     response = func.HttpResponse(
         body="ok",
@@ -275,10 +651,9 @@ def orchestrator_list(req: func.HttpRequest) -> func.HttpResponse:
     global GLOBAL_HISTORY_PROVIDER
     import json
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -311,10 +686,9 @@ def who_am_i(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     import json
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -343,10 +717,9 @@ def admin_config_list(req: func.HttpRequest) -> func.HttpResponse:
     import json
     from aiproxy.utils.config import load_configs
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -376,16 +749,66 @@ def admin_config_list(req: func.HttpRequest) -> func.HttpResponse:
         response.headers.extend(login_resp.headers)
     return response
 
+@app.route(route="a-cache-stats", methods=["GET"])
+def admin_cache_stats(req: func.HttpRequest) -> func.HttpResponse:
+    ensure_app_setup()
+    import json
+    from data import ReqContext
+    from utils.auth_cache import GLOBAL_AUTH_CACHE
+    from utils.asset_cache import UI_ASSET_CACHE
+    from utils.fs import LOCAL_FILE_CACHE
+    from utils.workers import worker_stats
+    from utils.orchestrator_cache import GLOBAL_ORCHESTRATOR_POOL
+    from utils.response_cache import GLOBAL_COMPLETION_CACHE
+    from utils.single_flight import GLOBAL_COMPLETION_FLIGHTS
+    from utils.rate_limit import rate_limit_stats
+
+    ## Validate the Request
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
+    if not valid: 
+        login_resp.headers["x-path"] = req.route_params.get("path", req.url)
+        return login_resp
+
+    context = ReqContext(req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
+
+    if not context.is_admin:
+        return func.HttpResponse(
+            status_code=403,
+            headers={
+                "reason": "Forbidden",
+            },
+        )
+    
+    response = func.HttpResponse(
+        body=json.dumps({
+            "auth": GLOBAL_AUTH_CACHE.stats(),
+            "ui-assets": UI_ASSET_CACHE.stats(),
+            "local-files": LOCAL_FILE_CACHE.stats(),
+            "orchestrators": GLOBAL_ORCHESTRATOR_POOL.stats(),
+            "completions": GLOBAL_COMPLETION_CACHE.stats(),
+            "completion-flights": GLOBAL_COMPLETION_FLIGHTS.stats(),
+            "rate-limits": rate_limit_stats(),
+            "prompt-workers": worker_stats(),
+        }),
+        status_code=200, 
+        headers={
+            "content-type": "application/json",
+        }
+    )
+    ## Add the headers from the login response
+    if login_resp is not None and login_resp.status_code == 0:
+        response.headers.extend(login_resp.headers)
+    return response
+
 @app.route(route="a-get-config", methods=["POST", "GET"])
 def admin_get_config(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     import json
     from aiproxy.utils.config import get_config_record
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -431,10 +854,9 @@ def admin_update_config(req: func.HttpRequest) -> func.HttpResponse:
     import json
     from aiproxy.utils.config import update_config
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -476,33 +898,63 @@ def admin_update_config(req: func.HttpRequest) -> func.HttpResponse:
 
 
 @app.route(route="assistant", methods=["POST", "GET"])
-def chat_with_assistant(req: func.HttpRequest) -> func.HttpResponse:
+async def chat_with_assistant(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     global GLOBAL_HISTORY_PROVIDER
 
     import json
-    from aiproxy import AssistantProxy, GLOBAL_PROXIES_REGISTRY, ChatResponse
-    from aiproxy.orchestration.multi_agent_orchestrator import MultiAgentOrchestrator
-    from aiproxy.data import ChatConfig
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
+    from utils.workers import run_blocking
+    from utils.rate_limit import admit_request, rate_limited_response
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = await run_blocking(validate_request, req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
 
     context = ReqContext(req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
 
-    context.init_history()  ## Ensure that the history for this conversation has been loaded
-
     prompt = context.get_req_val("prompt", None)
     if prompt is None: 
         raise ValueError("No prompt specified")
     
-    assistant = context.get_req_val("assistant") or context.get_req_val("assistants") or context.get_req_val("assistant-id") or context.get_req_val("assistant-name") or context.get_req_val("assistantid")
-    
+    assistant = context.get_first_req_val("assistant")
+
+    ## Hold back (briefly) or reject the request if its subscription is over its token rate limit
+    retry_after = await admit_request(context, prompt)
+    if retry_after is not None:
+        return rate_limited_response(retry_after)
+
+    result = await run_blocking(send_to_assistant, prompt, context, assistant)
+
+    chat_responses = [resp.to_api_response() for resp in result]
+    response = func.HttpResponse(
+        body=json.dumps({
+            "response": chat_responses, 
+            "context": context.build_context()
+        }, indent=4),
+        status_code=200, 
+        headers={
+            "content-type": "application/json",
+        }
+    )
+    ## Add the headers from the login response
+    if login_resp is not None and login_resp.status_code == 0:
+        response.headers.extend(login_resp.headers)
+    return response
+
+
+def send_to_assistant(prompt:str, context, assistant:str) -> list:
+    """
+    Send the prompt to the assistant(s) (blocking, loading + saving the history of the conversation), returns the responses
+    """
+    from aiproxy import AssistantProxy, GLOBAL_PROXIES_REGISTRY, ChatResponse
+    from aiproxy.orchestration.multi_agent_orchestrator import MultiAgentOrchestrator
+    from aiproxy.data import ChatConfig
+
+    context.init_history()  ## Ensure that the history for this conversation has been loaded
+
     proxy = None
     result:list[ChatResponse] = None
     if ',' in assistant:
@@ -526,22 +978,7 @@ def chat_with_assistant(req: func.HttpRequest) -> func.HttpResponse:
             result = proxy.send_message_and_return_outcome(prompt, context, assistant)
         else: 
             raise AssertionError("The proxy is not an AssistantProxy")
-
-    chat_responses = [resp.to_api_response() for resp in result]
-    response = func.HttpResponse(
-        body=json.dumps({
-            "response": chat_responses, 
-            "context": context.build_context()
-        }, indent=4),
-        status_code=200, 
-        headers={
-            "content-type": "application/json",
-        }
-    )
-    ## Add the headers from the login response
-    if login_resp is not None and login_resp.status_code == 0:
-        response.headers.extend(login_resp.headers)
-    return response
+    return result
 
 
 
@@ -564,10 +1001,9 @@ def bf_start_conversation(req: func.HttpRequest) -> func.HttpResponse:
     import json
     from data import ReqContext
     from botframework import BotframeworkFacade
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -604,10 +1040,9 @@ async def bf_conversation_activity(req: func.HttpRequest, client) -> func.HttpRe
 
     from data import ReqContext
     from botframework import BotframeworkFacade
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -623,7 +1058,7 @@ async def bf_conversation_activity(req: func.HttpRequest, client) -> func.HttpRe
     facade = BotframeworkFacade(context)
 
     # Get the User's prompt to validate that there is a prompt ;p
-    prompt = context.get_req_val("text", None) or context.get_req_val("prompt", None)   ## Text is used by botframework's webclient, prompt is commonly used by other types of clients
+    prompt = context.get_first_req_val("text", None)   ## Text is used by botframework's webclient, prompt is commonly used by other types of clients
     if prompt is None:  
         return func.HttpResponse(
             status_code=400,
@@ -646,8 +1081,10 @@ async def bf_conversation_activity(req: func.HttpRequest, client) -> func.HttpRe
 def bf_conversation_orchestrator(context:df.DurableOrchestrationContext):
     ensure_app_setup()
 
-    logging.warning(f"bf_conversation_orchestrator: {context.get_input().thread_id}")
-    prompt_outcome = yield context.call_activity("bf_send_prompt", context.get_input())
+    ## Deserialise the input once (it's passed as-is to each of the activities)
+    req_context = context.get_input()
+    logging.warning(f"bf_conversation_orchestrator: {req_context.thread_id}")
+    prompt_outcome = yield context.call_activity("bf_send_prompt", req_context)
     if not prompt_outcome:
         logging.warning(f"bf_conversation_orchestrator:No prompt outcome")
         return
@@ -658,12 +1095,12 @@ def bf_conversation_orchestrator(context:df.DurableOrchestrationContext):
     # if from_speech: 
     #    post_prompt_tasks.append(context.call_activity("send_speech_response", context.get_input()))
     
-    logging.warning(f"bf_conversation_orchestrator:Prompt outcome: {prompt_outcome} [Thread ID: {context.get_input().thread_id}]")
+    logging.warning(f"bf_conversation_orchestrator:Prompt outcome: {prompt_outcome} [Thread ID: {req_context.thread_id}]")
     post_activities = []
-    if context.get_input().get_config_value("send-suggestions", True):
-        post_activities.append(context.call_activity("bf_send_suggestions", context.get_input()))
-    if context.get_input().get_config_value("send-sentiment", True):
-        post_activities.append(context.call_activity("bf_send_sentiment", context.get_input()))
+    if req_context.get_config_value("send-suggestions", True):
+        post_activities.append(context.call_activity("bf_send_suggestions", req_context))
+    if req_context.get_config_value("send-sentiment", True):
+        post_activities.append(context.call_activity("bf_send_sentiment", req_context))
     outputs = yield context.task_all(post_activities)
     ## Other things that might be useful to do: 
     #   - Pull out key information about the conversation into the user profile notes to remember for future conversations 
@@ -696,7 +1133,7 @@ def bf_send_prompt(context):
     facade = BotframeworkFacade(context)
 
     # Get the User's prompt
-    prompt = context.get_req_val("text", None) or context.get_req_val("prompt", None)   ## Text is used by botframework's webclient, prompt is commonly used by other types of clients
+    prompt = context.get_first_req_val("text", None)   ## Text is used by botframework's webclient, prompt is commonly used by other types of clients
     if prompt is None:  
         raise ValueError("Prompt is required (Specified as either: text or prompt)")
     
@@ -766,10 +1203,9 @@ def bf_conversation(req: func.HttpRequest) -> func.HttpResponse:
     import json
     from data import ReqContext
     from botframework import BotframeworkFacade
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -818,10 +1254,9 @@ def create_stream(req: func.HttpRequest) -> func.HttpResponse:
     from uuid import uuid4
     from data import ReqContext
     from aiproxy.streaming import stream_factory, PubsubStreamWriter, BotframeworkStreamWriter
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -856,10 +1291,9 @@ def push_stream(req: func.HttpRequest) -> func.HttpResponse:
     from azure.messaging.webpubsubservice import WebPubSubServiceClient
     import logging
     import os
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -919,10 +1353,9 @@ def ip_notify(req: func.HttpRequest) -> func.HttpResponse:
     from azure.messaging.webpubsubservice import WebPubSubServiceClient
     import logging
     import os
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -984,10 +1417,9 @@ def connect(req: func.HttpRequest) -> func.HttpResponse:
     from data import ReqContext
     from aiproxy.streaming import PubsubStreamWriter, stream_factory
     from botframework import DEFAULT_BOT_ORCHESTRATOR
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -1048,10 +1480,9 @@ def refresh_speechtoken(req: func.HttpRequest) -> func.HttpResponse:
 
     import json
     from data import ReqContext
-    from subauth.function_utils import validate_function_request
 
     ## Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, default_fail_status=401)
     if not valid: 
         login_resp.headers["x-path"] = req.route_params.get("path", req.url)
         return login_resp
@@ -1083,10 +1514,10 @@ def callback(req: func.HttpRequest) -> func.HttpResponse:
     global GLOBAL_HISTORY_PROVIDER
 
     import os
-    from data import ReqContext
+    from data import StaticContext
     from subauth.function_utils import handle_entra_auth_callback
     
-    context = ReqContext(req, history_provider=GLOBAL_HISTORY_PROVIDER)
+    context = StaticContext(req)
     return handle_entra_auth_callback(req, context.get_config_value('ui-default-redirect-url', os.environ.get("DEFAULT_REDIRECT_URL", "/")))
 
 
@@ -1094,9 +1525,13 @@ def callback(req: func.HttpRequest) -> func.HttpResponse:
 def serve_ui(req: func.HttpRequest) -> func.HttpResponse:
     ensure_app_setup()
     import os
-    from data import ReqContext
+    from data import StaticContext
     from utils.media_types import infer_content_type
-    from subauth.function_utils import validate_function_request
+    from utils.http_cache import format_etag, content_etag, format_http_date, is_not_modified, parse_range, if_range_matches, RangeNotSatisfiableError
+    from utils.asset_cache import DEFAULT_MAX_RANGE_BYTES
+    from utils.cache_control import resolve_cache_control
+    from utils.asset_manifest import get_asset_source, is_known_missing
+    from utils.compression import is_compressible, choose_encoding, get_encoded_variant, variant_etag, DEFAULT_MIN_COMPRESS_BYTES
 
     ## Step 0: Get and adjust the path
     path = req.route_params.get("path", "index.html")
@@ -1105,7 +1540,7 @@ def serve_ui(req: func.HttpRequest) -> func.HttpResponse:
 
     
     ## Step 1: Validate the Request
-    valid, subscription, login_resp = validate_function_request(req, override_path=path, redirect_on_fail=True, default_fail_status=401)
+    valid, subscription, login_resp = validate_request(req, override_path=path, redirect_on_fail=True, default_fail_status=401)
     if not valid and (path.endswith("robots.txt") or path.endswith("manifest.json")):
         valid = True
         
@@ -1113,20 +1548,31 @@ def serve_ui(req: func.HttpRequest) -> func.HttpResponse:
         login_resp.headers["x-path"] = path
         return login_resp
 
-    context = ReqContext(req, subscription=subscription, history_provider=GLOBAL_HISTORY_PROVIDER)
+    ## Static assets only need the UI config, so use the lightweight context (skipping all the chat related setup)
+    context = StaticContext(req, subscription=subscription)
 
-    blob_data = None
+    asset = None
+    load_sibling = None
 
     try: 
+        ## Answer straight away if the asset manifest confirms that there is no such asset
+        if is_known_missing(path, get_asset_source(context)):
+            return func.HttpResponse(
+                body="Not Found",
+                status_code=404
+            )
+
         ## Check if we're serving from Blob storage or from the local file system
         ui_local_path = context.get_config_value("ui-local-path", os.environ.get("UI_LOCAL_PATH", None))
         if ui_local_path is not None:
-            from utils.fs import load_file
+            from utils.fs import load_file_asset
             file_path = os.path.join(ui_local_path, path)
-            blob_data = load_file(file_path, ui_local_path)
+            asset = load_file_asset(file_path, ui_local_path)
+            load_sibling = lambda sibling_path: load_file_asset(sibling_path, ui_local_path)
         else: 
-            from utils.blob import get_blob_data
-            blob_data = get_blob_data(path, context)
+            from utils.blob import get_blob_asset
+            asset = get_blob_asset(path, context)
+            load_sibling = lambda sibling_path: get_blob_asset(sibling_path, context)
     except FileNotFoundError as e:
         return func.HttpResponse(
             body="Not Found",
@@ -1139,7 +1585,7 @@ def serve_ui(req: func.HttpRequest) -> func.HttpResponse:
         )
 
 
-    if blob_data is None:
+    if asset is None or (asset.data is None and not asset.is_large):
         return func.HttpResponse(
             body="Not Found",
             status_code=404
@@ -1148,73 +1594,80 @@ def serve_ui(req: func.HttpRequest) -> func.HttpResponse:
     ## Infer content type from the file extension
     content_type = infer_content_type(path)
 
-    if path.endswith(".js"):
-        blob_data = blob_data.decode("utf-8", errors="ignore").encode("utf-8", errors="ignore")
+    ## Strong validators for the asset (from the blob ETag, or a hash of the content)
+    etag = format_etag(asset.etag) if asset.etag is not None else content_etag(asset.data)
+    last_modified = asset.last_modified
 
     headers = {
-        "Content-Type": content_type
+        "Content-Type": content_type,
+        "ETag": etag,
     }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_http_date(last_modified)
+
+    ## Check if a single range of the asset has been requested (eg. when seeking within a video)
+    byte_range = None
+    try: 
+        if if_range_matches(req.headers, etag, last_modified):
+            byte_range = parse_range(req.headers.get("range", None), asset.size)
+    except RangeNotSatisfiableError:
+        return func.HttpResponse(
+            status_code=416,
+            headers={ "Content-Range": f"bytes */{asset.size}" }
+        )
+    if byte_range is None and asset.is_large:
+        ## Large assets are never loaded in full, so without a (matching) Range the first chunk is served - as a 206, so the client can request the rest in ranges
+        byte_range = (0, asset.size - 1)
+    if byte_range is not None:
+        ## Serve large ranges in chunks (the client will request the next chunk when it needs it)
+        max_range_bytes = int(context.get_config_value("ui-max-range-bytes", DEFAULT_MAX_RANGE_BYTES))
+        byte_range = (byte_range[0], min(byte_range[1], byte_range[0] + max_range_bytes - 1))
+
+    ## Compress text based assets with the client's preferred encoding (compressed once per version of the asset, then cached)
+    body = None
+    encoding = None
+    if is_compressible(content_type):
+        headers["Vary"] = "Accept-Encoding"
+        min_compress_bytes = int(context.get_config_value("ui-compress-min-bytes", DEFAULT_MIN_COMPRESS_BYTES))
+        if byte_range is None and not asset.is_large and asset.size >= min_compress_bytes:
+            encoding = choose_encoding(req.headers.get("accept-encoding", None))
+        if encoding is not None:
+            body = get_encoded_variant(asset, encoding, load_sibling)
+            etag = variant_etag(etag, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = etag
+    if encoding is None:
+        headers["Accept-Ranges"] = "bytes"
 
     ## Get the configured cache settings
-    cache_settings = context.get_config_value("ui-cache-control", None)
-    if cache_settings is not None:
-        if type(cache_settings) is str:
-            cache_settings = { "Cache-Control": cache_settings }
-            headers.update(cache_settings)
-        elif type(cache_settings) is dict:
-            if path in cache_settings:
-                headers.update({ "Cache-Control": cache_settings[path] })
-            else:
-                import re
-                for key, val in cache_settings.items():
-                    ## Key is a regex pattern, so check if it matches the path
-                    # Load pattern from the key, then do match
-                    if key.startswith("regex:"):
-                        pattern = key[6:]
-                        if re.match(pattern, path):
-                            headers.update({ "Cache-Control": val })
-                            break
-                    elif key.endswith("*"):
-                        if path.startswith(key[:-1]):
-                            headers.update({ "Cache-Control": val })
-                            break
-        elif type(cache_settings) is list:
-            for item in cache_settings:
-                if path in item:
-                    headers.update({ "Cache-Control": item[path] })
-                    break
-                else:
-                    import re
-                    for key, val in item.items():
-                        ## Key is a regex pattern, so check if it matches the path
-                        # Load pattern from the key, then do match
-                        if key.startswith("regex:"):
-                            pattern = key[6:]
-                            if re.match(pattern, path):
-                                headers.update({ "Cache-Control": val })
-                                break
-                        elif key.endswith("*"):
-                            if path.startswith(key[:-1]):
-                                headers.update({ "Cache-Control": val })
-                                break
-    else:
-        ## Apply default cache control
-        if 'imgs/' in path or 'images/' in path or 'img/' in path:
-            ## Cache Images for 1week
-            headers["Cache-Control"] = "public, max-age=604800"
-        elif 'lib/' in path or 'scripts/' in path or 'js/' in path:
-            ## Cache Libraries for 48 hours
-            headers["Cache-Control"] = "public, max-age=172800"
-        else:
-            ## No Cache
-            headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    cache_control = resolve_cache_control(context.get_config_value("ui-cache-control", None), path, context.config_snapshot.key if context.config_snapshot is not None else None)
+    if cache_control is not None:
+        headers["Cache-Control"] = cache_control
 
 
-    response = func.HttpResponse(
-        body=blob_data,
-        status_code=200,
-        headers=headers
-    )
+    if is_not_modified(req.headers, etag, last_modified):
+        ## The client already has the current version, so there's no need to send the body again
+        del headers["Content-Type"]
+        response = func.HttpResponse(
+            status_code=304,
+            headers=headers
+        )
+    elif byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+        response = func.HttpResponse(
+            body=asset.read(start, end),
+            status_code=206,
+            headers=headers
+        )
+    else: 
+        if body is None:
+            body = asset.data
+        response = func.HttpResponse(
+            body=body,
+            status_code=200,
+            headers=headers
+        )
 
     ## Add the headers from the login response
     if login_resp is not None and login_resp.status_code == 0:
@@ -1253,7 +1706,7 @@ def determine_override_system_prompt(context) -> str:
     if type(context) is not ReqContext:
         raise AssertionError("The context must be a ReqContext object")
     
-    override_system_prompt = context.get_req_val("system-prompt") or context.get_req_val("prompt-config") or context.get_req_val("prompt-file")
+    override_system_prompt = context.get_first_req_val("system-prompt")
     if override_system_prompt is not None:
         ## Secret hack to allow specifying the system prompt directly
         if override_system_prompt.startswith("!DIRECT!"):
@@ -0,0 +1,213 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+DEFAULT_MAX_CACHE_BYTES = 64 * 1024 * 1024      ## 64MB across all cached assets
+DEFAULT_MAX_ITEM_BYTES = 4 * 1024 * 1024        ## Assets larger than this are never cached
+DEFAULT_REVALIDATE_SECS = 30                    ## How long a cached ETag is trusted before re-checking storage
+DEFAULT_MAX_RANGE_BYTES = 4 * 1024 * 1024       ## The most bytes served in response to a single Range request
+
+VARIANT_SEPARATOR = "#"     ## Separates the path of an asset from the encoding of a (cached) encoded variant of it, eg. "main.js#br"
+
+
+class StaticAsset:
+    """
+    A static asset (eg. a file from the UI bundle) along with the metadata needed to serve it.
+
+    Small assets hold their full contents in `data`. 
+    Large assets (eg. videos) are not held in memory, instead their contents are read in chunks (ranges) as needed via `read`.
+    """
+    path:str = None
+    container:str = None            ## The source (storage container or local folder) the asset was loaded from
+    data:bytes = None
+    etag:str = None
+    last_modified:object = None     ## datetime (or None if unknown)
+    length:int = None               ## The total size of the asset (in bytes)
+    reader:Callable[[int, int], bytes] = None
+    head:bytes = None               ## The first chunk of a large asset (when already loaded for this request)
+
+    def __init__(self, path:str, data:bytes, etag:str = None, last_modified:object = None, container:str = None, length:int = None, reader:Callable[[int, int], bytes] = None, head:bytes = None) -> None:
+        self.path = path
+        self.container = container
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.length = length
+        self.reader = reader
+        self.head = head
+
+    @property
+    def size(self) -> int:
+        if self.data is not None: return len(self.data)
+        return self.length or 0
+
+    @property
+    def is_large(self) -> bool:
+        return self.data is None and self.reader is not None
+
+    @property
+    def cached_bytes(self) -> int:
+        ## The number of bytes of content this asset holds in memory
+        return len(self.data) if self.data is not None else 0
+
+    def read(self, start:int, end:int) -> bytes:
+        """
+        Read the (inclusive) byte range of the asset
+        """
+        if self.data is not None:
+            return self.data[start:end + 1]
+        if self.head is not None and end < len(self.head):
+            return self.head[start:end + 1]
+        return self.reader(start, end)
+
+    def without_head(self) -> 'StaticAsset':
+        return StaticAsset(self.path, self.data, etag=self.etag, last_modified=self.last_modified, container=self.container, length=self.length, reader=self.reader)
+
+
+class AssetCache:
+    """
+    A thread-safe LRU cache of static assets, bounded by the total number of bytes held.
+
+    Entries are keyed by (container, path, etag), so a new version of an asset never collides with an old one.
+    The latest known ETag for each (container, path) is tracked separately, along with when it was last confirmed with storage.
+    """
+
+    def __init__(self, max_bytes:int = DEFAULT_MAX_CACHE_BYTES, max_item_bytes:int = DEFAULT_MAX_ITEM_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries:OrderedDict = OrderedDict()
+        self._latest:dict = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def latest_etag(self, container:str, path:str) -> tuple[str, float]:
+        """
+        Returns the latest known ETag for the asset + the time (epoch secs) it was last confirmed, or (None, None) if unknown
+        """
+        return self._latest.get((container, path), (None, None))
+
+    def confirm(self, container:str, path:str, etag:str, confirmed_at:float):
+        """
+        Record that storage has confirmed the given ETag is (still) the current version of the asset
+        """
+        with self._lock:
+            if (container, path, etag) in self._entries:
+                self._latest[(container, path)] = (etag, confirmed_at)
+
+    def get(self, container:str, path:str, etag:str) -> StaticAsset:
+        key = (container, path, etag)
+        with self._lock:
+            asset = self._entries.get(key, None)
+            if asset is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return asset
+
+    def put(self, container:str, path:str, asset:StaticAsset, confirmed_at:float) -> bool:
+        """
+        Add the asset to the cache (replacing any older version of it), returns False if the asset is too large to be cached
+
+        Large assets are cached as a descriptor only (their contents are read in chunks, so are never held by the cache)
+        """
+        if asset.etag is None or asset.cached_bytes > self.max_item_bytes or asset.cached_bytes > self.max_bytes:
+            return False
+        if asset.head is not None:
+            asset = asset.without_head()
+
+        key = (container, path, asset.etag)
+        with self._lock:
+            ## Drop the previous version of this asset (if there is one)
+            prev_etag, _ = self._latest.get((container, path), (None, None))
+            if prev_etag is not None and prev_etag != asset.etag:
+                self._remove((container, path, prev_etag))
+            self._remove(key)
+
+            self._entries[key] = asset
+            self._latest[(container, path)] = (asset.etag, confirmed_at)
+            self.current_bytes += asset.cached_bytes
+
+            ## Evict the least recently used assets until we're back under budget
+            while self.current_bytes > self.max_bytes and len(self._entries) > 0:
+                old_key, _ = next(iter(self._entries.items()))
+                self._remove(old_key)
+                self.evictions += 1
+        return True
+
+    def containers(self) -> set[str]:
+        with self._lock:
+            return set(key[0] for key in self._entries.keys())
+
+    def sync(self, container:str, current_etags:dict[str, str], confirmed_at:float) -> tuple[int, int]:
+        """
+        Sync the cached assets of a container with the current ETags of the assets in storage (eg. from a listing of the container).
+
+        Assets (and their encoded variants) whose ETag has changed, or that no longer exist, are evicted. 
+        The rest are confirmed as current, so they don't need to be revalidated individually.
+
+        Returns the number of (confirmed, evicted) entries
+        """
+        confirmed = 0
+        evicted = 0
+        with self._lock:
+            for key in [ key for key in self._entries.keys() if key[0] == container ]:
+                path = key[1]
+                base_path = path.rsplit(VARIANT_SEPARATOR, 1)[0] if VARIANT_SEPARATOR in path else path
+                current = current_etags.get(base_path, None)
+                if current is None and base_path != path:
+                    current = current_etags.get(path, None)     ## The '#' is part of the blob name, rather than a variant
+                    base_path = path
+                if current is None or _strip_etag(current) != _strip_etag(key[2]):
+                    self._remove(key)
+                    evicted += 1
+                else:
+                    self._latest[(container, path)] = (key[2], confirmed_at)
+                    confirmed += 1
+        return (confirmed, evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max-bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit-rate": (self.hits / lookups) if lookups > 0 else 0.0,
+            }
+
+    def _remove(self, key:tuple):
+        ## Must be called whilst holding the lock
+        asset = self._entries.pop(key, None)
+        if asset is not None:
+            self.current_bytes -= asset.cached_bytes
+            latest = self._latest.get((key[0], key[1]), None)
+            if latest is not None and latest[0] == key[2]:
+                del self._latest[(key[0], key[1])]
+
+
+def _strip_etag(etag:str) -> str:
+    if etag is None: return None
+    etag = etag.strip()
+    if etag.startswith("W/"): etag = etag[2:]
+    return etag.strip('"')
+
+
+## The global cache of UI assets (shared across all requests within this worker process)
+UI_ASSET_CACHE = AssetCache(
+    max_bytes=int(os.environ.get("UI_ASSET_CACHE_MAX_BYTES", DEFAULT_MAX_CACHE_BYTES)),
+    max_item_bytes=int(os.environ.get("UI_ASSET_CACHE_MAX_ITEM_BYTES", DEFAULT_MAX_ITEM_BYTES)),
+)
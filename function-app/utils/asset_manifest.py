@@ -0,0 +1,214 @@
+import logging
+import threading
+
+DEFAULT_MANIFEST_MAX_AGE_SECS = 120     ## A manifest older than this is not trusted to answer 404s (eg. if refreshes have been failing)
+DEFAULT_PREFETCH_ENTRY = "index.html"
+DEFAULT_UI_ASSET_POLL_SECS = 10         ## How often each instance polls the UI asset source(s) for changes (UI_ASSET_POLL_SECS, 0 to disable)
+
+
+class ManifestEntry:
+    path:str = None
+    size:int = None
+    etag:str = None
+    content_type:str = None
+    last_modified:object = None
+
+    def __init__(self, path:str, size:int, etag:str, content_type:str, last_modified:object = None) -> None:
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.last_modified = last_modified
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "size": self.size,
+            "etag": self.etag,
+            "content-type": self.content_type,
+        }
+
+
+class AssetManifest:
+    """
+    An in-memory index of the UI assets available from a source (storage container or local folder)
+    """
+    source:str = None
+    entries:dict[str, ManifestEntry] = None
+    refreshed_at:float = None
+
+    def __init__(self, source:str) -> None:
+        self.source = source
+        self.entries = {}
+        self.refreshed_at = None
+
+    def contains(self, path:str) -> bool:
+        return path in self.entries
+
+    def get(self, path:str) -> ManifestEntry:
+        return self.entries.get(path, None)
+
+    def is_fresh(self, max_age_secs:float) -> bool:
+        import time
+        return self.refreshed_at is not None and (time.time() - self.refreshed_at) < max_age_secs
+
+    def update(self, listed:list[ManifestEntry]) -> list[str]:
+        """
+        Update the manifest from a fresh listing of the source, returning the paths that have changed (added, modified or removed)
+        """
+        import time
+        changed = []
+        seen = set()
+        entries = dict(self.entries)
+        for entry in listed:
+            seen.add(entry.path)
+            existing = entries.get(entry.path, None)
+            if existing is None or existing.etag != entry.etag:
+                entries[entry.path] = entry
+                changed.append(entry.path)
+        for path in list(entries.keys()):
+            if path not in seen:
+                del entries[path]
+                changed.append(path)
+
+        ## Swap in the new entries (so readers never see a partially updated manifest)
+        self.entries = entries
+        self.refreshed_at = time.time()
+        return changed
+
+
+## The manifest of the UI assets (built at startup + refreshed by the UI asset poll of this instance)
+GLOBAL_UI_MANIFEST:AssetManifest = None
+_MANIFEST_LOCK = threading.Lock()
+
+
+def get_asset_source(context) -> str:
+    """
+    Returns the identifier of the source the UI assets are served from for the given context (matches the `container` of the loaded assets)
+    """
+    import os
+    ui_local_path = context.get_config_value("ui-local-path", os.environ.get("UI_LOCAL_PATH", None))
+    if ui_local_path is not None:
+        return "file://" + ui_local_path
+    from utils.blob import get_container_client
+    container_client = get_container_client(context)
+    return f"{container_client.account_name}/{container_client.container_name}"
+
+
+def list_ui_assets(context) -> list[ManifestEntry]:
+    """
+    List all the UI assets in the configured source (local folder or storage container)
+    """
+    import os
+    from utils.media_types import infer_content_type
+
+    listed = []
+    ui_local_path = context.get_config_value("ui-local-path", os.environ.get("UI_LOCAL_PATH", None))
+    if ui_local_path is not None:
+        from datetime import datetime, timezone
+        for root, _, files in os.walk(ui_local_path):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, ui_local_path).replace(os.sep, "/")
+                stat = os.stat(full_path)
+                etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+                listed.append(ManifestEntry(path, stat.st_size, etag, infer_content_type(path), datetime.fromtimestamp(stat.st_mtime_ns / 1e9, tz=timezone.utc)))
+    else:
+        from utils.blob import get_container_client
+        container_client = get_container_client(context)
+        for blob in container_client.list_blobs():
+            listed.append(ManifestEntry(blob.name, blob.size, blob.etag, infer_content_type(blob.name), blob.last_modified))
+    return listed
+
+
+def refresh_ui_manifest(context, listed:list[ManifestEntry] = None) -> list[str]:
+    """
+    (Re)build the UI asset manifest, returns the paths that have changed since the last refresh
+    """
+    global GLOBAL_UI_MANIFEST
+    with _MANIFEST_LOCK:
+        source = get_asset_source(context)
+        if listed is None:
+            listed = list_ui_assets(context)
+        manifest = GLOBAL_UI_MANIFEST
+        if manifest is None or manifest.source != source:
+            manifest = AssetManifest(source)
+        changed = manifest.update(listed)
+        GLOBAL_UI_MANIFEST = manifest
+        return changed
+
+
+def refresh_ui_assets(context):
+    """
+    Poll the UI asset source(s) for changes - refreshing the manifest, and evicting (only) the cached assets that have changed.
+
+    The source of the default config is listed once, and that listing is used for both the manifest and the cache.
+    The source is only listed if there is a manifest to refresh, or the cache holds assets from it (the other sources are only listed if the cache holds assets from them).
+    """
+    from utils.blob import poll_cached_blob_assets
+    from utils.asset_cache import UI_ASSET_CACHE
+    listings = {}
+    try: 
+        source = get_asset_source(context)
+        if GLOBAL_UI_MANIFEST is not None or source in UI_ASSET_CACHE.containers():
+            listed = list_ui_assets(context)
+            if GLOBAL_UI_MANIFEST is not None:
+                changed = refresh_ui_manifest(context, listed)
+                if len(changed) > 0:
+                    logging.info(f"UI assets changed: {changed}")
+            listings[source] = { entry.path: entry.etag for entry in listed }
+    except ValueError:
+        pass    ## The default config doesn't have UI storage configured (other configs might though)
+    poll_cached_blob_assets(listings)
+
+
+def is_known_missing(path:str, source:str, max_age_secs:float = DEFAULT_MANIFEST_MAX_AGE_SECS) -> bool:
+    """
+    Returns True if the (fresh) manifest for the source confirms that the asset does not exist
+    """
+    manifest = GLOBAL_UI_MANIFEST
+    if manifest is None or manifest.source != source or not manifest.is_fresh(max_age_secs):
+        return False
+    return not manifest.contains(path)
+
+
+def prefetch_ui_assets(context, entry_path:str = DEFAULT_PREFETCH_ENTRY):
+    """
+    Load the entry page (eg. index.html) + the local assets it references into the asset cache
+    """
+    import re
+    manifest = GLOBAL_UI_MANIFEST
+    if manifest is None or not manifest.contains(entry_path): return
+
+    entry = _load_asset(entry_path, context)
+    if entry is None or entry.data is None: return
+
+    html = entry.data.decode("utf-8", errors="ignore")
+    for ref in re.findall(r'(?:src|href)\s*=\s*["\']([^"\']+)["\']', html):
+        if ref.startswith(("http:", "https:", "//", "data:", "#", "mailto:")): continue
+        path = _find_manifest_path(manifest, ref.split("?")[0].split("#")[0])
+        if path is None: continue
+        try:
+            _load_asset(path, context)
+        except Exception as e:
+            logging.warning(f"Failed to prefetch UI asset: {path} - {e}")
+
+
+def _find_manifest_path(manifest:AssetManifest, ref:str) -> str:
+    ## References can be relative to a base path (eg. /api/app/static/js/main.js), so find the longest suffix that is in the manifest
+    parts = [ p for p in ref.split("/") if len(p) > 0 and p != "." ]
+    for idx in range(len(parts)):
+        candidate = "/".join(parts[idx:])
+        if manifest.contains(candidate):
+            return candidate
+    return None
+
+
+def _load_asset(path:str, context):
+    import os
+    ui_local_path = context.get_config_value("ui-local-path", os.environ.get("UI_LOCAL_PATH", None))
+    if ui_local_path is not None:
+        from utils.fs import load_file_asset
+        return load_file_asset(os.path.join(ui_local_path, path), ui_local_path)
+    from utils.blob import get_blob_asset
+    return get_blob_asset(path, context)
@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import azure.functions as func
+
+DEFAULT_AUTH_CACHE_TTL_SECS = 60
+DEFAULT_AUTH_CACHE_NEGATIVE_TTL_SECS = 5
+DEFAULT_AUTH_CACHE_MAX_ENTRIES = 4096
+
+## Every header + param of a request is treated as (potentially) part of its credential, except for these - which vary per request but can't carry a credential.
+## (Excluding too little only lowers the hit rate, whereas excluding a header that does carry a credential would let requests share a decision)
+NON_CREDENTIAL_HEADERS = frozenset([ 
+    "accept", "accept-encoding", "accept-language", "cache-control", "connection", "content-length", "content-type", "date", "host", "if-modified-since", "if-none-match", 
+    "if-range", "max-forwards", "origin", "pragma", "range", "referer", "request-context", "request-id", "traceparent", "tracestate", "user-agent", "client-ip", 
+    "disguised-host", "was-default-hostname", "x-appservice-proto", "x-client-ip", "x-client-port", "x-request-id", "x-site-deployment-id", "stream-id", "context", "config", "x-config",
+])
+NON_CREDENTIAL_HEADER_PREFIXES = ( "sec-", "x-arr-", "x-forwarded-", "x-original-", "x-waws-" )
+## The options of `validate_function_request` that only shape the response to a failed validation
+FAILURE_ONLY_OPTIONS = frozenset([ "override_path", "redirect_on_fail", "default_fail_status" ])
+NON_CREDENTIAL_PARAMS = frozenset([
+    "prompt", "text", "thread", "thread-id", "conversation", "conversation-id", "conversation_id", "bot-conversation-id", "context", "config", "stream-id", 
+    "orchestrator", "orchestrator-type", "assistant", "use-functions", "timeout", "timeout-secs", "system-prompt", "path",
+])
+
+
+class AuthDecisionCache:
+    """
+    A thread-safe, in-process cache of the auth decisions (+ resolved subscriptions) for the credentials presented by requests.
+
+    Entries are keyed by a hash of the credential (so the credential itself is never held) - which is every header + param of the request that could carry one.
+    They live for the TTL, or until the credential expires (if it's a JWT), whichever is sooner. Failures are cached for a (much) shorter TTL.
+    """
+
+    def __init__(self, ttl_secs:float = DEFAULT_AUTH_CACHE_TTL_SECS, negative_ttl_secs:float = DEFAULT_AUTH_CACHE_NEGATIVE_TTL_SECS, max_entries:int = DEFAULT_AUTH_CACHE_MAX_ENTRIES) -> None:
+        self.ttl_secs = ttl_secs
+        self.negative_ttl_secs = negative_ttl_secs
+        self.max_entries = max_entries
+        self._entries:OrderedDict = OrderedDict()   ## key -> (expires_at, value, valid)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, key:str, record_miss:bool = True) -> any:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                if record_miss: self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry[2]:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return entry[1]
+
+    def put(self, key:str, value:any, valid:bool, expires_at:float = None):
+        ttl = self.ttl_secs if valid else self.negative_ttl_secs
+        if ttl <= 0: return
+        until = time.time() + ttl
+        if expires_at is not None:
+            until = min(until, expires_at)
+        with self._lock:
+            self._entries[key] = (until, value, valid)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max-entries": self.max_entries,
+                "hits": self.hits,
+                "negative-hits": self.negative_hits,
+                "misses": self.misses,
+                "hit-rate": ((self.hits + self.negative_hits) / lookups) if lookups > 0 else 0.0,
+            }
+
+
+## The global cache of the auth decisions (validate_function_request) + subscriptions (get_subscription)
+GLOBAL_AUTH_CACHE = AuthDecisionCache(
+    ttl_secs=float(os.environ.get("AUTH_CACHE_TTL_SECS", DEFAULT_AUTH_CACHE_TTL_SECS)),
+    negative_ttl_secs=float(os.environ.get("AUTH_CACHE_NEGATIVE_TTL_SECS", DEFAULT_AUTH_CACHE_NEGATIVE_TTL_SECS)),
+    max_entries=int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", DEFAULT_AUTH_CACHE_MAX_ENTRIES)),
+)
+
+
+def validate_function_request_cached(req:func.HttpRequest, **kwargs) -> tuple:
+    """
+    A cached version of subauth's `validate_function_request` - the decision is cached for the credential presented by the request (+ the options used to validate it).
+    Successful decisions are shared by all paths, failed ones are cached per path (as their login/redirect response depends on it).
+
+    Returns the same (valid, subscription, login_resp) tuple, with a copy of the login response (so callers can modify it)
+    """
+    from urllib.parse import urlparse
+    from subauth.function_utils import validate_function_request
+
+    credential, expires_at = _credential_of(req)
+    ## A successful decision only depends on the credential (so it is shared by every route, eg. all the `app/*` assets of a page load),
+    ## whereas a failure's (login/redirect) response depends on the path + the options that shape it
+    ok_key = _hash_key("req-ok", credential, sorted((k, str(v)) for k,v in kwargs.items() if k not in FAILURE_ONLY_OPTIONS))
+    cached = GLOBAL_AUTH_CACHE.get(ok_key, record_miss=False)    ## A miss is only recorded once both keys have been checked
+    if cached is not None:
+        valid, subscription, login_resp = cached
+        return valid, subscription, _copy_response(login_resp)
+
+    ## The query isn't part of the path (as it would make every request unique)
+    path = kwargs.get("override_path", None) or urlparse(req.url).path
+    fail_key = _hash_key("req-fail", credential, path, sorted((k, str(v)) for k,v in kwargs.items()))
+    cached = GLOBAL_AUTH_CACHE.get(fail_key)
+    if cached is not None:
+        valid, subscription, login_resp = cached
+        return valid, subscription, _copy_response(login_resp)
+
+    valid, subscription, login_resp = validate_function_request(req, **kwargs)
+    GLOBAL_AUTH_CACHE.put(ok_key if valid else fail_key, (valid, subscription, _copy_response(login_resp)), valid, expires_at)
+    return valid, subscription, login_resp
+
+
+def get_subscription_cached(sub_id:str, raise_if_not_found:bool = False):
+    """
+    A cached version of subauth's `get_subscription`
+    """
+    from subauth import get_subscription
+    if sub_id is None: return get_subscription(sub_id, raise_if_not_found)
+    key = _hash_key("sub", sub_id)
+    cached = GLOBAL_AUTH_CACHE.get(key)
+    if cached is not None:
+        return cached[0]
+    subscription = get_subscription(sub_id, raise_if_not_found)
+    GLOBAL_AUTH_CACHE.put(key, (subscription,), subscription is not None)
+    return subscription
+
+
+def _hash_key(*parts) -> str:
+    import hashlib
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _credential_of(req:func.HttpRequest) -> tuple[tuple, float]:
+    ## Returns the credential material of the request, along with the earliest expiry of any JWTs in it (if there are any)
+    credential = []
+    if req.headers is not None:
+        for name, val in req.headers.items():
+            name = name.lower()
+            if name in NON_CREDENTIAL_HEADERS or name.startswith(NON_CREDENTIAL_HEADER_PREFIXES): continue
+            credential.append(("h", name, val))
+    if req.params is not None:
+        for name, val in req.params.items():
+            if name in NON_CREDENTIAL_PARAMS: continue
+            credential.append(("p", name, val))
+    credential.sort()
+
+    expires_at = None
+    for _, name, val in credential:
+        if "eyJ" not in val: continue   ## Not a JWT (nor a cookie holding one)
+        for candidate in (val.split(";") if name == "cookie" else [ val ]):
+            exp = _jwt_expiry(candidate.split("=", 1)[-1] if name == "cookie" else candidate)
+            if exp is not None:
+                expires_at = exp if expires_at is None else min(expires_at, exp)
+    return tuple(credential), expires_at
+
+
+def _jwt_expiry(val:str) -> float:
+    ## The expiry of the token, if it's a JWT (the signature isn't checked here, it's only used to bound how long the decision is cached for)
+    import json
+    import base64
+    val = val.strip()
+    if val.lower().startswith("bearer "): val = val[7:].strip()
+    parts = val.split(".")
+    if len(parts) != 3 or not parts[0].startswith("eyJ"): return None
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(parts[1] + "=" * (-len(parts[1]) % 4)))
+        exp = claims.get("exp", None)
+        return float(exp) if exp is not None else None
+    except Exception:
+        return None
+
+
+def _copy_response(resp:func.HttpResponse) -> func.HttpResponse:
+    if resp is None: return None
+    return func.HttpResponse(
+        body=resp.get_body(),
+        status_code=resp.status_code,
+        headers={ k:v for k,v in resp.headers.items() },
+        mimetype=resp.mimetype,
+        charset=resp.charset,
+    )
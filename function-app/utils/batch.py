@@ -0,0 +1,65 @@
+import os
+import asyncio
+import contextlib
+
+DEFAULT_BATCH_MAX_ITEMS = 100
+DEFAULT_BATCH_MAX_CONCURRENCY = 4       ## Per subscription, across all the batches it has in flight
+
+BATCH_ITEM_RESERVED_FIELDS = ( "prompts", "items", "config", "x-config" )   ## Fields an item can't override (the config is shared by the whole batch)
+
+
+class _SubscriptionLimiter:
+    def __init__(self, limit:int) -> None:
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+## The concurrency limiters of the subscriptions with batches in flight (they are dropped once idle)
+_LIMITERS:dict[str, _SubscriptionLimiter] = {}
+
+
+def batch_max_items(context) -> int:
+    return int(context.get_config_value("batch-max-items", None) or os.environ.get("BATCH_MAX_ITEMS", DEFAULT_BATCH_MAX_ITEMS))
+
+
+def batch_max_concurrency(context) -> int:
+    return max(1, int(context.get_config_value("batch-max-concurrency", None) or os.environ.get("BATCH_MAX_CONCURRENCY", DEFAULT_BATCH_MAX_CONCURRENCY)))
+
+
+def parse_batch_items(body:dict) -> list[dict]:
+    """
+    Parse the items of a batch request - `prompts` is a list of prompts (strings), or of objects with a `prompt` + any per-item overrides (eg. `system-prompt`, `orchestrator`, `use-functions`, `thread`)
+
+    Raises a ValueError if the batch is not valid
+    """
+    if body is None: raise ValueError("No prompts specified")
+    raw = body.get("prompts", None) or body.get("items", None)
+    if not isinstance(raw, list) or len(raw) == 0:
+        raise ValueError("No prompts specified")
+    items = []
+    for raw_item in raw:
+        item = { "prompt": raw_item } if type(raw_item) is str else raw_item
+        if not isinstance(item, dict) or type(item.get("prompt", None)) is not str or len(item["prompt"].strip()) == 0:
+            raise ValueError(f"Item {len(items)} of the batch has no prompt")
+        items.append({ k:v for k,v in item.items() if k not in BATCH_ITEM_RESERVED_FIELDS })
+    return items
+
+
+@contextlib.asynccontextmanager
+async def subscription_slot(key:str, limit:int):
+    """
+    Wait for one of the (limited) slots of the subscription to run a batch item in
+    """
+    limiter = _LIMITERS.get(key, None)
+    if limiter is None:
+        limiter = _LIMITERS[key] = _SubscriptionLimiter(limit)
+    limiter.users += 1
+    try:
+        async with limiter.semaphore:
+            yield
+    finally:
+        limiter.users -= 1
+        if limiter.users == 0 and _LIMITERS.get(key, None) is limiter:
+            del _LIMITERS[key]
+
@@ -1,74 +1,267 @@
 from data import ReqContext
+from utils.asset_cache import UI_ASSET_CACHE, StaticAsset, DEFAULT_REVALIDATE_SECS
 
-from functools import lru_cache
 
-@lru_cache(maxsize=512)
-def get_blob_data(path:str, context:ReqContext) -> bytes: 
-    import os
-    from azure.storage.blob import BlobServiceClient
-    from azure.core.exceptions import ResourceNotFoundError
-    from azure.identity import DefaultAzureCredential
+class BlobClientRegistry:
+    """
+    A process-wide registry of Blob Storage clients, keyed by the (resolved) storage config they were created from.
+
+    Re-using the clients means re-using their HTTP connection pools (avoiding a new TLS handshake per request), and re-using a single 
+    DefaultAzureCredential means tokens are cached across requests, with the SDK's token policy refreshing them before they expire.
+    """
+
+    def __init__(self) -> None:
+        import threading
+        self._service_clients:dict = {}
+        self._container_clients:dict = {}
+        self._credential = None
+        self._lock = threading.Lock()
+
+    def get_default_credential(self):
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    from azure.identity import DefaultAzureCredential
+                    self._credential = DefaultAzureCredential()
+        return self._credential
+
+    def get_service_client(self, storage_config:tuple):
+        """
+        Get (or create) the BlobServiceClient for the storage config (as resolved by `resolve_storage_config`)
+        """
+        key = _storage_config_key(storage_config)
+        client = self._service_clients.get(key, None)
+        if client is not None: return client
+
+        with self._lock:
+            client = self._service_clients.get(key, None)
+            if client is None:
+                client = self._create_service_client(storage_config)
+                self._service_clients[key] = client
+        return client
+
+    def get_container_client(self, storage_config:tuple, container_name:str):
+        key = (_storage_config_key(storage_config), container_name)
+        client = self._container_clients.get(key, None)
+        if client is not None: return client
+
+        service_client = self.get_service_client(storage_config)
+        with self._lock:
+            client = self._container_clients.get(key, None)
+            if client is None:
+                client = service_client.get_container_client(container_name)
+                self._container_clients[key] = client
+        return client
+
+    def reset(self):
+        with self._lock:
+            self._service_clients.clear()
+            self._container_clients.clear()
+
+    def _create_service_client(self, storage_config:tuple):
+        from azure.storage.blob import BlobServiceClient
+        kind = storage_config[0]
+        if kind == "connection-string":
+            return BlobServiceClient.from_connection_string(storage_config[1])
+        if kind == "account-key":
+            return BlobServiceClient(storage_config[1], credential=storage_config[2])
+        if kind == "managed-identity":
+            return BlobServiceClient(account_url=f"https://{storage_config[1]}.blob.core.windows.net", credential=self.get_default_credential())
+        if kind == "anonymous":
+            return BlobServiceClient(account_url=f"https://{storage_config[1]}.blob.core.windows.net")
+        raise ValueError(f"Unknown storage config type: {kind}")
+
+
+def _storage_config_key(storage_config:tuple) -> tuple:
+    ## Don't hold the secrets (connection strings + keys) in the registry's keys
+    import hashlib
+    return (storage_config[0], hashlib.sha256("|".join(storage_config[1:]).encode("utf-8")).hexdigest())
+
 
-    ## Serve static file from Azure Blob Storage
-    blob_service_client = None
+## The global registry of Blob Storage clients (for use by anything in the app that needs to talk to Blob Storage)
+GLOBAL_BLOB_CLIENTS = BlobClientRegistry()
+
+
+def resolve_storage_config(context:ReqContext) -> tuple:
+    """
+    Resolve the storage account to use for the UI from the config (falling back to the environment), 
+    returning a tuple of the type of config followed by the values that identify the account
+    """
+    import os
 
     ## Setup Storage Connection
     blob_storage_connection = context.get_config_value("ui-storage-connection-string")
     if blob_storage_connection is not None:
-        blob_service_client = BlobServiceClient.from_connection_string(blob_storage_connection)
-    else:
-        account_url = context.get_config_value("ui-storage-account-url")
-        credential = context.get_config_value("ui-storage-account-key")
-        if account_url is not None and credential is not None:
-            blob_service_client = BlobServiceClient(account_url, credential=credential)
-
+        return ("connection-string", blob_storage_connection)
+    account_url = context.get_config_value("ui-storage-account-url")
+    credential = context.get_config_value("ui-storage-account-key")
+    if account_url is not None and credential is not None:
+        return ("account-key", account_url, credential)
 
     ## Check for a Managed Identity Config
     account_name = context.get_config_value("ui-storage-account-name", os.environ.get("UI_STORAGE_ACCOUNT_NAME", None))
-    if blob_service_client is None and account_name is not None:
-        blob_service_client = BlobServiceClient(account_url=f"https://{account_name}.blob.core.windows.net", credential=DefaultAzureCredential())
+    if account_name is not None:
+        return ("managed-identity", account_name)
 
     # Fallback to default storage account
-    if blob_service_client is None:
-        blob_storage_connection = os.environ.get("UI_STORAGE_CONNECTION_STRING")
-        if blob_storage_connection is not None:
-            blob_service_client = BlobServiceClient.from_connection_string(blob_storage_connection)
-        else:
-            account_url = os.environ.get("UI_STORAGE_ACCOUNT_URL")
-            credential = os.environ.get("UI_STORAGE_ACCOUNT_KEY")
-            if account_url is not None and credential is not None:
-                blob_service_client = BlobServiceClient(account_url, credential=credential)
-            else:
-                account_name = os.environ.get("UI_STORAGE_ACCOUNT_NAME", os.environ.get("AZURE_STORAGE_ACCOUNT_NAME", None))
-                if account_name is not None:
-                    blob_service_client = BlobServiceClient(account_url=f"https://{account_name}.blob.core.windows.net")
-
-    if blob_service_client is None:
-        raise ValueError("Blob service not configured correctly.")
-
-    ## Setup Storage Container
+    blob_storage_connection = os.environ.get("UI_STORAGE_CONNECTION_STRING")
+    if blob_storage_connection is not None:
+        return ("connection-string", blob_storage_connection)
+    account_url = os.environ.get("UI_STORAGE_ACCOUNT_URL")
+    credential = os.environ.get("UI_STORAGE_ACCOUNT_KEY")
+    if account_url is not None and credential is not None:
+        return ("account-key", account_url, credential)
+    account_name = os.environ.get("UI_STORAGE_ACCOUNT_NAME", os.environ.get("AZURE_STORAGE_ACCOUNT_NAME", None))
+    if account_name is not None:
+        return ("anonymous", account_name)
+
+    raise ValueError("Blob service not configured correctly.")
+
+
+def get_blob_service_client(context:ReqContext):
+    return GLOBAL_BLOB_CLIENTS.get_service_client(resolve_storage_config(context))
+
+
+def get_container_client(context:ReqContext, container_name:str = None):
+    if container_name is None:
+        container_name = get_container_name(context)
+    return GLOBAL_BLOB_CLIENTS.get_container_client(resolve_storage_config(context), container_name)
+
+
+def get_container_name(context:ReqContext) -> str:
+    import os
     container_name = context.get_config_value("ui-storage-container-name")
     if container_name is None:
         container_name = os.environ.get("UI_STORAGE_CONTAINER_NAME")
 
     if container_name is None:
         raise ValueError("Blob container name not configured correctly.")
+    return container_name
+
+
+## The containers that assets have been loaded (and cached) from, so that they can be polled for changes
+_CACHED_CONTAINERS:dict = {}
+
+
+def get_blob_asset(path:str, context:ReqContext) -> StaticAsset:
+    """
+    Load a static asset from Blob Storage, serving it from the UI asset cache whenever the cached version is known to be current.
+
+    Only the first `ui-asset-cache-max-item-bytes` of a blob are downloaded up front - blobs larger than this are returned as 
+    a large asset, whose remaining contents are downloaded in ranges as they are requested.
+    """
+    import time
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError, HttpResponseError
 
-    ## Load the Client + Download the file
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=path)
+    container_client = get_container_client(context)
+    cache_container = f"{container_client.account_name}/{container_client.container_name}"
+    _CACHED_CONTAINERS[cache_container] = container_client
+    revalidate_secs = float(context.get_config_value("ui-cache-revalidate-secs", DEFAULT_REVALIDATE_SECS))
 
-    blob_data = None
+    ## Serve from the cache if we've confirmed the cached version with storage recently
+    known_etag, confirmed_at = UI_ASSET_CACHE.latest_etag(cache_container, path)
+    if known_etag is not None and (time.time() - confirmed_at) < revalidate_secs:
+        asset = UI_ASSET_CACHE.get(cache_container, path, known_etag)
+        if asset is not None:
+            return asset
+
+    ## Load the Client + Download the file (only if it has changed from the version we have cached)
+    blob_client = container_client.get_blob_client(path)
+    probe_length = UI_ASSET_CACHE.max_item_bytes
+
+    asset = None
     retries = 3
     while retries > 0:
         try:
-            # encoding param is necessary for readall() to return str, otherwise it returns bytes
-            downloader = blob_client.download_blob(max_concurrency=1, encoding=None)
-            blob_data = downloader.readall()
-            retries = 0
+            conditions = { "etag": known_etag, "match_condition": MatchConditions.IfModified } if known_etag is not None else {}
+            try: 
+                # encoding param is necessary for readall() to return str, otherwise it returns bytes
+                downloader = blob_client.download_blob(offset=0, length=probe_length, max_concurrency=1, encoding=None, **conditions)
+            except HttpResponseError as e:
+                if e.status_code != 416: raise
+                ## Ranged downloads of empty blobs are not satisfiable, so download the whole (empty) blob instead
+                downloader = blob_client.download_blob(max_concurrency=1, encoding=None, **conditions)
+
+            data = downloader.readall()
+            props = downloader.properties
+            total_size = _blob_total_size(props)
+            if total_size is not None and total_size > len(data):
+                ## This is a large blob, so the rest of it is downloaded in ranges as needed
+                asset = StaticAsset(path, None, etag=props.etag, last_modified=props.last_modified, container=cache_container, length=total_size, reader=_blob_range_reader(blob_client, props.etag), head=data)
+            else: 
+                asset = StaticAsset(path, data, etag=props.etag, last_modified=props.last_modified, container=cache_container)
+            UI_ASSET_CACHE.put(cache_container, path, asset, time.time())
             break
+        except ResourceNotModifiedError:
+            ## The cached version is still current
+            UI_ASSET_CACHE.confirm(cache_container, path, known_etag, time.time())
+            asset = UI_ASSET_CACHE.get(cache_container, path, known_etag)
+            if asset is not None:
+                break
+            known_etag = None  ## The cached version has since been evicted, so download it again
         except ResourceNotFoundError:
             raise FileNotFoundError(f"Blob {path} does not exist.")
         except Exception as e:
             retries -= 1
-    
-    return blob_data
\ No newline at end of file
+
+    return asset
+
+
+def _blob_total_size(props) -> int:
+    """
+    Returns the size of the whole blob - for a ranged download, `props.size` is the size of the range, so the total is taken from the Content-Range (eg. "bytes 0-4194303/12582912")
+    """
+    content_range = getattr(props, "content_range", None)
+    if content_range is not None:
+        total = str(content_range).rsplit("/", 1)[-1].strip()
+        if total.isdigit():
+            return int(total)
+    return props.size
+
+
+def _blob_range_reader(blob_client, etag:str):
+    from azure.core import MatchConditions
+
+    def read_range(start:int, end:int) -> bytes:
+        ## Only read from the same version of the blob (raises if the blob has been changed since)
+        downloader = blob_client.download_blob(offset=start, length=(end - start + 1), max_concurrency=1, encoding=None, etag=etag, match_condition=MatchConditions.IfNotModified)
+        return downloader.readall()
+    return read_range
+
+
+def list_blob_etags(container_client) -> dict[str, str]:
+    """
+    List the current ETag of every blob in the container (the listing is paged, so this is one call per 5000 blobs)
+    """
+    return { blob.name: blob.etag for blob in container_client.list_blobs() }
+
+
+def poll_cached_blob_assets(listings:dict[str, dict[str, str]] = None) -> dict[str, tuple[int, int]]:
+    """
+    Compare the cached blob assets against the current ETags in storage, evicting only the assets that have changed.
+
+    Existing listings (keyed by cache container) can be provided, to avoid listing those containers again.
+
+    Returns the number of (confirmed, evicted) cache entries for each container
+    """
+    import time
+    import logging
+    results = {}
+    cached = UI_ASSET_CACHE.containers()
+    for cache_container, container_client in list(_CACHED_CONTAINERS.items()):
+        if cache_container not in cached: continue
+        try: 
+            current_etags = listings.get(cache_container, None) if listings is not None else None
+            if current_etags is None:
+                current_etags = list_blob_etags(container_client)
+            results[cache_container] = UI_ASSET_CACHE.sync(cache_container, current_etags, time.time())
+        except Exception as e:
+            logging.warning(f"Failed to poll the UI assets in {cache_container} for changes: {e}")
+    return results
+
+
+def get_blob_data(path:str, context:ReqContext) -> bytes:
+    asset = get_blob_asset(path, context)
+    if asset is None: return None
+    return asset.data if not asset.is_large else asset.read(0, asset.size - 1)
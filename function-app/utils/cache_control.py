@@ -0,0 +1,174 @@
+import re
+import threading
+
+MAX_MEMOISED_PATHS = 4096
+MAX_CACHED_MATCHERS = 16
+
+_TERMINAL = ""  ## Key of the rule held at a node of the prefix trie
+
+
+class CacheControlMatcher:
+    """
+    The `ui-cache-control` settings compiled into a matcher, so that resolving the Cache-Control for a path doesn't scan the rules.
+
+    The settings can be:
+    * A string - used for every path
+    * A dict - keyed by the exact path, a prefix ending with `*`, or a regex prefixed with `regex:`, an exact match takes precedence, otherwise the first rule to match wins
+    * A list of dicts - each dict is checked in order (as per the dict rules), with a later dict's match overriding an earlier one's - except for an exact match, which ends the search (so the first dict with an exact match wins)
+
+    Rules are compiled into an exact path dict, a prefix trie and a single (ordered) alternation regex.
+    Each rule is ranked by its position (see `_rank`), and the lowest ranked match across all three wins - so the precedence of the rules is kept.
+    """
+
+    def __init__(self, cache_settings:any) -> None:
+        self._use_defaults = cache_settings is None
+        self._value_for_all = cache_settings if type(cache_settings) is str else None
+        self._exact:dict[str, tuple] = {}
+        self._trie:dict = {}
+        self._regex = None
+        self._regex_rules:dict[str, tuple] = {}
+        self._regex_fallback:list[tuple] = None
+        self._memo:dict[str, str] = {}
+
+        rule_sets = []
+        if type(cache_settings) is dict:
+            rule_sets = [ cache_settings ]
+        elif type(cache_settings) is list:
+            rule_sets = [ item for item in cache_settings if type(item) is dict ]
+
+        regex_rules = []
+        for set_idx, rules in enumerate(rule_sets):
+            for rule_idx, (key, val) in enumerate(rules.items()):
+                if key not in self._exact:
+                    self._exact[key] = (_rank(set_idx, None), val)
+                rank = _rank(set_idx, rule_idx)
+                if key.startswith("regex:"):
+                    regex_rules.append((rank, key[6:], val))
+                elif key.endswith("*"):
+                    self._add_prefix(key[:-1], rank, val)
+        self._compile_regex(regex_rules)
+
+    def match(self, path:str) -> str:
+        """
+        Returns the Cache-Control value for the path (or None if no rule matches)
+        """
+        if self._value_for_all is not None: return self._value_for_all
+        if self._use_defaults: return _default_cache_control(path)
+
+        val = self._memo.get(path, _TERMINAL)
+        if val is not _TERMINAL: return val
+
+        val = self._match(path)
+        if len(self._memo) >= MAX_MEMOISED_PATHS:
+            self._memo.clear()
+        self._memo[path] = val
+        return val
+
+    def _match(self, path:str) -> str:
+        best = self._exact.get(path, None)
+
+        ## Walk the prefix trie, checking the rule (if any) at each node along the path
+        node = self._trie
+        for ch in path:
+            best = _lowest(best, node.get(_TERMINAL, None))
+            node = node.get(ch, None)
+            if node is None: break
+        if node is not None:
+            best = _lowest(best, node.get(_TERMINAL, None))
+
+        ## Then the regex rules
+        if self._regex is not None:
+            m = self._regex.match(path)
+            if m is not None:
+                name = m.lastgroup if m.lastgroup in self._regex_rules else next(n for n, v in m.groupdict().items() if v is not None and n in self._regex_rules)
+                best = _lowest(best, self._regex_rules[name])
+        elif self._regex_fallback is not None:
+            for rank, pattern, val in self._regex_fallback:
+                if pattern.match(path):
+                    best = _lowest(best, (rank, val))
+                    break
+
+        return best[1] if best is not None else None
+
+    def _add_prefix(self, prefix:str, rank:tuple, val:str):
+        node = self._trie
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[_TERMINAL] = _lowest(node.get(_TERMINAL, None), (rank, val))
+
+    def _compile_regex(self, regex_rules:list[tuple]):
+        if len(regex_rules) == 0: return
+        regex_rules = sorted(regex_rules, key=lambda rule: rule[0])
+        ## Combine the patterns into a single alternation (in rank order, so the first alternative to match is the lowest ranked matching rule)
+        try:
+            if any(re.search(r"\\[1-9]|\(\?P=", pattern) for _, pattern, _ in regex_rules):
+                raise re.error("Back-references can't be combined")
+            alternatives = []
+            for idx, (rank, pattern, val) in enumerate(regex_rules):
+                name = f"_cc_rule_{idx}"
+                alternatives.append(f"(?P<{name}>(?:{pattern}))")
+                self._regex_rules[name] = (rank, val)
+            self._regex = re.compile("|".join(alternatives))
+        except re.error:
+            ## Fallback to checking each pattern in turn
+            self._regex = None
+            self._regex_rules = {}
+            self._regex_fallback = [ (rank, re.compile(pattern), val) for rank, pattern, val in regex_rules ]
+
+
+def _rank(set_idx:int, rule_idx:int) -> tuple:
+    ## An exact match beats any other rule (and the first set with one wins), otherwise the match from the last set wins, and within a set the first rule to match wins
+    if rule_idx is None: return (0, set_idx, 0)
+    return (1, -set_idx, rule_idx)
+
+
+def _lowest(current:tuple, candidate:tuple) -> tuple:
+    if candidate is None: return current
+    if current is None or candidate[0] < current[0]: return candidate
+    return current
+
+
+def _default_cache_control(path:str) -> str:
+    ## Apply default cache control
+    if 'imgs/' in path or 'images/' in path or 'img/' in path:
+        ## Cache Images for 1week
+        return "public, max-age=604800"
+    elif 'lib/' in path or 'scripts/' in path or 'js/' in path:
+        ## Cache Libraries for 48 hours
+        return "public, max-age=172800"
+    else:
+        ## No Cache
+        return "no-cache, no-store, must-revalidate"
+
+
+_MATCHERS:dict = {}
+_MATCHERS_LOCK = threading.Lock()
+
+
+def get_cache_control_matcher(cache_settings:any, version_key:tuple = None) -> CacheControlMatcher:
+    """
+    Get the compiled matcher for the settings (compiled once, then re-used for as long as the config holds the same settings)
+
+    If the version of the config the settings came from is given (ie. the key of its ConfigSnapshot), the matcher is re-used for as long as that version is current
+    """
+    key = ("version", version_key) if version_key is not None else id(cache_settings)
+    entry = _MATCHERS.get(key, None)
+    if entry is not None and (version_key is not None or entry[0] is cache_settings):
+        return entry[1]
+
+    matcher = CacheControlMatcher(cache_settings)
+    with _MATCHERS_LOCK:
+        if len(_MATCHERS) >= MAX_CACHED_MATCHERS:
+            _MATCHERS.clear()
+        ## Hold a reference to the settings, so the id can't be re-used whilst the matcher is cached
+        _MATCHERS[key] = (cache_settings, matcher)
+    return matcher
+
+
+def resolve_cache_control(cache_settings:any, path:str, version_key:tuple = None) -> str:
+    """
+    Determine the Cache-Control header value for a UI asset, using the configured `ui-cache-control` settings (or the defaults if there are none)
+
+    Returns None if the settings don't specify a value for the path
+    """
+    return get_cache_control_matcher(cache_settings, version_key).match(path)
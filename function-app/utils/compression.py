@@ -0,0 +1,123 @@
+import gzip
+from typing import Callable
+
+from utils.asset_cache import UI_ASSET_CACHE, StaticAsset, VARIANT_SEPARATOR
+
+try:
+    import brotli
+except ImportError:
+    brotli = None   ## Brotli is optional, without it only gzip is offered
+
+DEFAULT_MIN_COMPRESS_BYTES = 1024
+
+COMPRESSIBLE_TYPES = [
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "application/manifest+json",
+    "image/svg+xml",
+]
+
+## The file extension used for pre-built (compressed at build time) variants of an asset
+SIBLING_EXTENSIONS = {
+    "br": ".br",
+    "gzip": ".gz",
+}
+
+
+def is_compressible(content_type:str) -> bool:
+    if content_type is None: return False
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def supported_encodings() -> list[str]:
+    ## In order of preference
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding:str) -> str:
+    """
+    Choose the content encoding to use for a response, based on the Accept-Encoding header of the request.
+
+    Returns None if the response should not be compressed
+    """
+    if accept_encoding is None or len(accept_encoding.strip()) == 0: return None
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        pieces = part.strip().split(";")
+        name = pieces[0].strip().lower()
+        if len(name) == 0: continue
+        weight = 1.0
+        for param in pieces[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+
+    best = None
+    best_weight = 0.0
+    for encoding in supported_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best = encoding
+            best_weight = weight
+    return best
+
+
+def compress(data:bytes, encoding:str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def variant_etag(etag:str, encoding:str) -> str:
+    """
+    The (strong) ETag of an encoded variant must differ from the ETag of the unencoded asset
+    """
+    if etag is None: return None
+    return etag[:-1] + "-" + encoding + '"' if etag.endswith('"') else etag + "-" + encoding
+
+
+def is_current_sibling(sibling:StaticAsset, asset:StaticAsset) -> bool:
+    """
+    A pre-built sibling is only trusted if it was written no earlier than the asset itself (if either time is unknown, it isn't trusted)
+    """
+    if sibling.data is None or sibling.last_modified is None or asset.last_modified is None: return False
+    return sibling.last_modified >= asset.last_modified
+
+
+def get_encoded_variant(asset:StaticAsset, encoding:str, load_sibling:Callable[[str], StaticAsset] = None) -> bytes:
+    """
+    Returns the asset encoded with the specified content encoding.
+
+    A pre-built sibling (eg. `app.js.br`) is used if one exists and is no older than the asset (so a stale sibling left over from a previous deploy is never served), otherwise the asset is compressed here.
+    Either way, the result is cached against the version (ETag) of the asset, so is only built once per version.
+    """
+    variant_path = asset.path + VARIANT_SEPARATOR + encoding
+    if asset.etag is not None:
+        cached = UI_ASSET_CACHE.get(asset.container, variant_path, asset.etag)
+        if cached is not None:
+            return cached.data
+
+    data = None
+    if load_sibling is not None:
+        try:
+            sibling = load_sibling(asset.path + SIBLING_EXTENSIONS[encoding])
+            if sibling is not None and is_current_sibling(sibling, asset):
+                data = sibling.data
+        except FileNotFoundError:
+            pass
+
+    if data is None:
+        data = compress(asset.data, encoding)
+
+    if asset.etag is not None:
+        import time
+        UI_ASSET_CACHE.put(asset.container, variant_path, StaticAsset(variant_path, data, etag=asset.etag, last_modified=asset.last_modified, container=asset.container), time.time())
+    return data
@@ -1,7 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from functools import lru_cache
 
-@lru_cache(maxsize=512)
+from utils.asset_cache import StaticAsset, DEFAULT_MAX_CACHE_BYTES, DEFAULT_MAX_ITEM_BYTES
+
+DEFAULT_MAX_OPEN_MAPS = 32
+
+
+class _OpenMap:
+    def __init__(self, identity:tuple, file, map) -> None:
+        self.identity = identity
+        self.file = file
+        self.map = map
+        self.readers = 0        ## The reads in progress (outside the lock), the map is only closed once there are none
+        self.evicted = False
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class LocalFileCache:
+    """
+    A thread-safe cache of files loaded from the local file system.
+
+    Each entry is validated against the file's (inode, mtime, size) on every lookup, so edits to files on disk are always picked up.
+    Small files are held in memory (bounded by a total byte budget, with LRU eviction).
+    Large files are memory mapped instead, and read as slices of the map - so they are never copied into memory in full.
+    """
+
+    def __init__(self, max_bytes:int = DEFAULT_MAX_CACHE_BYTES, max_item_bytes:int = DEFAULT_MAX_ITEM_BYTES, max_open_maps:int = DEFAULT_MAX_OPEN_MAPS) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.max_open_maps = max_open_maps
+        self._entries:OrderedDict = OrderedDict()     ## (path, containing folder) -> (identity, StaticAsset)
+        self._maps:OrderedDict = OrderedDict()        ## path -> _OpenMap
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_asset(self, file_path:str, check_is_under_path:str = None) -> StaticAsset:
+        from datetime import datetime, timezone
+        from utils.http_cache import content_etag
+
+        ## The path is checked before anything else (incl. a cache hit), so a path outside the folder fails the same way whether or not the file exists
+        path_to_file = _check_path(file_path, check_is_under_path)
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            raise FileNotFoundError(f"File {file_path} does not exist.")
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        key = (file_path, check_is_under_path)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        container = "file://" + check_is_under_path if check_is_under_path is not None else "file://"
+        last_modified = datetime.fromtimestamp(stat.st_mtime_ns / 1e9, tz=timezone.utc)
+
+        if stat.st_size > self.max_item_bytes:
+            ## Large files are read as slices of a memory map, as needed
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            asset = StaticAsset(file_path, None, etag=etag, last_modified=last_modified, container=container, length=stat.st_size, reader=lambda start, end: self.read_range(file_path, identity, start, end))
+        else:
+            with open(path_to_file, "rb") as f:
+                data = f.read()
+            asset = StaticAsset(file_path, data, etag=content_etag(data), last_modified=last_modified, container=container)
+
+        self._put(key, identity, asset)
+        return asset
+
+    def read_range(self, file_path:str, identity:tuple, start:int, end:int) -> bytes:
+        """
+        Read the (inclusive) byte range of a (large) file from its memory map
+        """
+        import mmap
+        with self._lock:
+            entry = self._maps.get(file_path, None)
+            if entry is None or entry.identity != identity:
+                if entry is not None:
+                    self._close_map(file_path)
+                f = open(file_path, "rb")
+                try:
+                    if os.fstat(f.fileno()).st_ino != identity[0]:
+                        raise FileNotFoundError(f"File {file_path} has changed.")
+                    entry = _OpenMap(identity, f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                except Exception:
+                    f.close()
+                    raise
+                self._maps[file_path] = entry
+                while len(self._maps) > self.max_open_maps:
+                    self._close_map(next(iter(self._maps.keys())))
+            else:
+                self._maps.move_to_end(file_path)
+            entry.readers += 1
+
+        ## The slice is copied outside the lock, so large reads don't hold up every other lookup
+        try:
+            return entry.map[start:end + 1]
+        finally:
+            with self._lock:
+                entry.readers -= 1
+                if entry.evicted and entry.readers == 0:
+                    entry.close()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            for path in list(self._maps.keys()):
+                self._close_map(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max-bytes": self.max_bytes,
+                "open-maps": len(self._maps),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit-rate": (self.hits / lookups) if lookups > 0 else 0.0,
+            }
+
+    def _put(self, key:tuple, identity:tuple, asset:StaticAsset):
+        if asset.cached_bytes > self.max_bytes: return
+        with self._lock:
+            prev = self._entries.pop(key, None)
+            if prev is not None:
+                self.current_bytes -= prev[1].cached_bytes
+            self._entries[key] = (identity, asset)
+            self.current_bytes += asset.cached_bytes
+            while self.current_bytes > self.max_bytes and len(self._entries) > 0:
+                _, (_, old) = self._entries.popitem(last=False)
+                self.current_bytes -= old.cached_bytes
+
+    def _close_map(self, file_path:str):
+        ## Must be called whilst holding the lock - a map that is being read from is closed by its last reader
+        entry = self._maps.pop(file_path, None)
+        if entry is not None:
+            entry.evicted = True
+            if entry.readers == 0:
+                entry.close()
+
+
+## The global cache of files loaded from the local file system (eg. when serving the UI from UI_LOCAL_PATH)
+LOCAL_FILE_CACHE = LocalFileCache(
+    max_bytes=int(os.environ.get("LOCAL_FILE_CACHE_MAX_BYTES", DEFAULT_MAX_CACHE_BYTES)),
+    max_item_bytes=int(os.environ.get("LOCAL_FILE_CACHE_MAX_ITEM_BYTES", os.environ.get("UI_ASSET_CACHE_MAX_ITEM_BYTES", DEFAULT_MAX_ITEM_BYTES))),
+)
+
+
 def load_file(file_path: str, check_is_under_path:str = None) -> bytes:
     """
     Load a file from the given path.
@@ -13,18 +170,38 @@ def load_file(file_path: str, check_is_under_path:str = None) -> bytes:
     Returns:
         bytes: The contents of the file as bytes.
     """
+    asset = LOCAL_FILE_CACHE.get_asset(file_path, check_is_under_path)
+    return asset.data if not asset.is_large else asset.read(0, asset.size - 1)
+
+
+def load_file_asset(file_path: str, check_is_under_path:str = None) -> StaticAsset:
+    """
+    Load a file from the given path as a StaticAsset (including a content-hash ETag and the last modified time of the file).
+
+    Files larger than the cache's max item size are not read up front, instead they are read in ranges (from a memory map) as needed.
+
+    Args:
+        file_path (str): The path to the file.
+        check_is_under_path (Path, optional): If provided, checks if the file is under this path.
+
+    Returns:
+        StaticAsset: The contents of the file, along with its ETag + last modified time.
+    """
+    return LOCAL_FILE_CACHE.get_asset(file_path, check_is_under_path)
+
+
+def _check_path(file_path: str, check_is_under_path:str = None) -> Path:
     path_to_file = Path(file_path)
     if check_is_under_path is not None:
-        check_path = Path(check_is_under_path)
-        if not path_to_file.is_relative_to(check_path):
+        ## Resolve the paths first, so that '..' segments can't be used to escape the folder
+        check_path = Path(check_is_under_path).resolve()
+        if not path_to_file.resolve().is_relative_to(check_path):
             raise ValueError(f"File {file_path} is not under {check_is_under_path}")
-        
+
         if not path_to_file.is_file():
             raise FileNotFoundError(f"File {file_path} does not exist.")
-    
-    with open(path_to_file, "rb") as f:
-        return f.read()
-    
+    return path_to_file
+
 
 if __name__ == "__main__":
     # Example usage
@@ -32,4 +209,4 @@ if __name__ == "__main__":
         data = load_file("/home/adam/data/ball.png", check_is_under_path="/home/")
         print(data)
     except Exception as e:
-        print(e)
\ No newline at end of file
+        print(e)
@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+
+
+def format_etag(etag:str) -> str:
+    """
+    Normalise an ETag (eg. as returned by Blob Storage) into a strong, quoted ETag
+    """
+    if etag is None: return None
+    etag = etag.strip()
+    if etag.startswith("W/"): etag = etag[2:]
+    return '"' + etag.strip('"') + '"'
+
+
+def content_etag(data:bytes) -> str:
+    """
+    Build a strong ETag from a hash of the content
+    """
+    import hashlib
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def format_http_date(dt:datetime) -> str:
+    if dt is None: return None
+    from email.utils import format_datetime
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+
+def _parse_http_date(val:str) -> datetime:
+    from email.utils import parsedate_to_datetime
+    try:
+        dt = parsedate_to_datetime(val)
+    except (TypeError, ValueError):
+        return None
+    if dt is None: return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def is_not_modified(headers, etag:str, last_modified:datetime) -> bool:
+    """
+    Evaluates the conditional request headers (If-None-Match / If-Modified-Since) against the current version of a resource.
+
+    Returns True if the client already holds the current version (ie. a 304 should be returned)
+    """
+    if headers is None: return False
+
+    ## If-None-Match takes precedence over If-Modified-Since (RFC 9110, 13.2.2)
+    if_none_match = headers.get("if-none-match", None)
+    if if_none_match is not None:
+        if etag is None: return False
+        if if_none_match.strip() == "*": return True
+        ## Use the weak comparison function, as is required for If-None-Match
+        current = etag.strip()
+        if current.startswith("W/"): current = current[2:]
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate.startswith("W/"): candidate = candidate[2:]
+            if candidate == current:
+                return True
+        return False
+
+    if_modified_since = headers.get("if-modified-since", None)
+    if if_modified_since is not None and last_modified is not None:
+        since = _parse_http_date(if_modified_since)
+        if since is None: return False
+        modified = last_modified if last_modified.tzinfo is not None else last_modified.replace(tzinfo=timezone.utc)
+        return modified.replace(microsecond=0) <= since
+
+    return False
+
+
+class RangeNotSatisfiableError(ValueError):
+    pass
+
+
+def parse_range(range_header:str, size:int) -> tuple[int, int]:
+    """
+    Parse a (single) byte range from the Range header of a request, returning the inclusive (start, end) positions.
+
+    Returns None if the header should be ignored (eg. it is missing, malformed, or requests multiple ranges), 
+    and raises a RangeNotSatisfiableError if the range is outside of the resource.
+    """
+    if range_header is None: return None
+    range_header = range_header.strip()
+    if not range_header.lower().startswith("bytes="): return None
+    spec = range_header[6:].strip()
+    if "," in spec: return None     ## Multiple ranges are not supported, so send the full resource instead
+
+    first, sep, last = spec.partition("-")
+    if sep != "-": return None
+    first = first.strip()
+    last = last.strip()
+    try:
+        if len(first) == 0:
+            ## Suffix range (ie. the last N bytes)
+            if len(last) == 0: return None
+            suffix = int(last)
+            if suffix <= 0 or size == 0: raise RangeNotSatisfiableError(range_header)
+            return (max(0, size - suffix), size - 1)
+
+        start = int(first)
+        end = int(last) if len(last) > 0 else size - 1
+    except ValueError as e:
+        if type(e) is RangeNotSatisfiableError: raise
+        return None
+
+    if start >= size: raise RangeNotSatisfiableError(range_header)
+    if end < start: return None
+    return (start, min(end, size - 1))
+
+
+def if_range_matches(headers, etag:str, last_modified:datetime) -> bool:
+    """
+    Evaluates the If-Range header (if provided), returning False if the Range should be ignored (because the resource has changed)
+    """
+    if headers is None: return True
+    if_range = headers.get("if-range", None)
+    if if_range is None: return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        ## Must use the strong comparison function (so weak ETags never match)
+        return etag is not None and not if_range.startswith("W/") and if_range == etag
+    since = _parse_http_date(if_range)
+    if since is None or last_modified is None: return False
+    modified = last_modified if last_modified.tzinfo is not None else last_modified.replace(tzinfo=timezone.utc)
+    return modified.replace(microsecond=0) == since
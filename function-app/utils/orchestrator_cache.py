@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_ORCHESTRATOR_POOL_MAX_KEYS = 64
+DEFAULT_ORCHESTRATOR_POOL_MAX_IDLE = 8      ## The most idle Orchestrators kept for each (name + version of its config)
+
+_LEASE_ATTR = "_orchestrator_pool_lease"    ## Set on a checked out Orchestrator, so it can be returned to the pool it came from
+
+
+class OrchestratorPool:
+    """
+    A thread-safe pool of built Orchestrators, keyed by the name + version of the config(s) they were built from.
+
+    Each turn checks an Orchestrator out exclusively (building one if none are idle) and releases it once the turn is done -
+    so an Orchestrator (+ its proxies and agents) is only ever used by one request at a time, but isn't rebuilt for every turn.
+    `invalidate` / `purge` drop the idle Orchestrators built from the old configs, and any that are checked out at the time are discarded when released.
+    """
+
+    def __init__(self, max_keys:int = DEFAULT_ORCHESTRATOR_POOL_MAX_KEYS, max_idle:int = DEFAULT_ORCHESTRATOR_POOL_MAX_IDLE) -> None:
+        self.max_keys = max_keys
+        self.max_idle = max_idle
+        self._idle:OrderedDict = OrderedDict()      ## key -> (idle Orchestrators, names of the configs they were built from)
+        self._generation = 0                        ## Bumped by every invalidate / purge
+        self._invalidated:dict[str, int] = {}       ## config name -> the generation it was last invalidated at
+        self._purged = 0                            ## The generation of the last purge
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def checkout(self, key:tuple, build, depends_on:set = None) -> any:
+        """
+        Take an idle Orchestrator for the key (building one if there are none), for the exclusive use of the caller until it is released
+        """
+        depends_on = frozenset(depends_on or ())
+        with self._lock:
+            generation = self._generation
+            entry = self._idle.get(key, None)
+            orchestrator = entry[0].pop() if entry is not None and len(entry[0]) > 0 else None
+            if orchestrator is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if orchestrator is None:
+            orchestrator = build()
+        try:
+            setattr(orchestrator, _LEASE_ATTR, (self, key, generation, depends_on))
+        except AttributeError:
+            pass    ## Can't be tracked, so it just isn't returned to the pool
+        return orchestrator
+
+    def release(self, orchestrator:any):
+        """
+        Return a checked out Orchestrator to the pool (a no-op for anything that wasn't checked out of it, or has already been released)
+        """
+        lease = getattr(orchestrator, _LEASE_ATTR, None)
+        if lease is None or lease[0] is not self: return
+        setattr(orchestrator, _LEASE_ATTR, None)
+        _, key, generation, depends_on = lease
+        with self._lock:
+            stale = self._purged > generation or any(self._invalidated.get(name, -1) > generation for name in depends_on)
+            entry = self._idle.get(key, None)
+            if stale or (entry is not None and len(entry[0]) >= self.max_idle):
+                self.discarded += 1
+                return
+            if entry is None:
+                entry = self._idle[key] = ([], depends_on)
+            entry[0].append(orchestrator)
+            self._idle.move_to_end(key)
+            while len(self._idle) > self.max_keys:
+                self._idle.popitem(last=False)
+
+    def invalidate(self, names:list[str]) -> int:
+        """
+        Drop the Orchestrators built from any of the named configs, returns the number of idle Orchestrators dropped
+        """
+        names = set(names)
+        if len(names) == 0: return 0
+        with self._lock:
+            self._generation += 1
+            for name in names:
+                self._invalidated[name] = self._generation
+            stale = [ key for key, (_, depends_on) in self._idle.items() if not depends_on.isdisjoint(names) ]
+            dropped = 0
+            for key in stale:
+                dropped += len(self._idle.pop(key)[0])
+        return dropped
+
+    def purge(self):
+        with self._lock:
+            self._generation += 1
+            self._purged = self._generation
+            self._invalidated.clear()
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "keys": len(self._idle),
+                "idle": sum(len(orchestrators) for orchestrators, _ in self._idle.values()),
+                "max-keys": self.max_keys,
+                "max-idle": self.max_idle,
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "hit-rate": (self.hits / lookups) if lookups > 0 else 0.0,
+            }
+
+
+## The global pool of the Orchestrators used by /chat (+ the streaming routes + batches) and the Bot Framework facade
+GLOBAL_ORCHESTRATOR_POOL = OrchestratorPool()
+
+
+def resolve_orchestrator_config(orchestrator_name:str, context, default_type:str) -> tuple:
+    """
+    Resolve the config of the Orchestrator with the given name (the named config, if there is one).
+
+    If there is no config with the name, a clone of the config of the context is used - with the requested `orchestrator-type`, otherwise the default type.
+
+    Returns the (pool key - the name + version of the config(s), names of the configs it depends on, a function that builds a new copy of the config)
+    """
+    from data.config_snapshot import get_config_snapshot
+
+    snapshot = get_config_snapshot(orchestrator_name)
+    if snapshot is not None:
+        ## Each Orchestrator gets its own copy, as the (cached) config is shared by every request
+        return snapshot.key, { orchestrator_name }, snapshot.config.clone
+
+    ## Create a default Config
+    orchestrator_type = context.get_req_val("orchestrator-type", None) or context.get_config_value("orchestrator-type", None) or default_type
+    def build():
+        orchestrator_config = context.config.clone()
+        orchestrator_config['type'] = orchestrator_type
+        orchestrator_config['name'] = orchestrator_name
+        return orchestrator_config
+    base = context.config_snapshot
+    if base is None:
+        return None, None, build
+    return (orchestrator_name, orchestrator_type) + base.key, { orchestrator_name, base.name }, build
+
+
+def load_orchestrator(orchestrator_name:str, context, default_type:str) -> any:
+    """
+    Check out an Orchestrator with the given name (built from its resolved config) for the exclusive use of this turn - `release_orchestrator` must be called once the turn is done
+    """
+    from aiproxy.orchestration import orchestrator_factory
+    key, depends_on, build_config = resolve_orchestrator_config(orchestrator_name, context, default_type)
+    if key is None:
+        return orchestrator_factory(build_config())
+    return GLOBAL_ORCHESTRATOR_POOL.checkout(key, lambda: orchestrator_factory(build_config()), depends_on)
+
+
+def release_orchestrator(orchestrator:any):
+    """
+    Return the Orchestrator (or proxy) used by a turn to the pool (a no-op if it didn't come from the pool)
+    """
+    if orchestrator is not None:
+        GLOBAL_ORCHESTRATOR_POOL.release(orchestrator)
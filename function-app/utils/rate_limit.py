@@ -0,0 +1,232 @@
+import os
+import abc
+import time
+import math
+import asyncio
+import threading
+
+import azure.functions as func
+
+DEFAULT_TIER = "default"
+DEFAULT_RATE_LIMIT_MAX_WAIT_SECS = 2.0      ## How long a request can be queued for tokens, before it is rejected (with a 429)
+DEFAULT_TOKEN_ENCODING = "cl100k_base"
+DEFAULT_MESSAGE_OVERHEAD_TOKENS = 4         ## The tokens each message costs, on top of its content (role, separators, etc)
+DEFAULT_MAX_BUCKETS = 65536
+
+
+class RateLimitBackend(abc.ABC):
+    """
+    The store of the token buckets - the in-memory backend limits each instance independently, a shared backend (eg. Redis, Cosmos) can be set with `set_rate_limit_backend` to limit across instances
+    """
+
+    @abc.abstractmethod
+    def acquire(self, key:str, tokens:float, capacity:float, refill_per_sec:float) -> float:
+        """
+        Take the tokens from the bucket for the key (if it has enough), returns 0 if they were taken, otherwise the seconds until the bucket will have enough
+        """
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    A thread-safe, in-process store of token buckets
+    """
+
+    def __init__(self, max_buckets:int = DEFAULT_MAX_BUCKETS) -> None:
+        self.max_buckets = max_buckets
+        self._buckets:dict[str, tuple[float, float, float]] = {}     ## key -> (tokens, updated_at, secs until full)
+        self._lock = threading.Lock()
+
+    def acquire(self, key:str, tokens:float, capacity:float, refill_per_sec:float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            available, updated_at, _ = self._buckets.get(key, (capacity, now, 0))
+            available = min(capacity, available + (now - updated_at) * refill_per_sec)
+            if available >= tokens:
+                available -= tokens
+                self._buckets[key] = (available, now, (capacity - available) / refill_per_sec if refill_per_sec > 0 else math.inf)
+                if len(self._buckets) > self.max_buckets:
+                    self._prune(now)
+                return 0.0
+            self._buckets[key] = (available, now, (capacity - available) / refill_per_sec if refill_per_sec > 0 else math.inf)
+            return (tokens - available) / refill_per_sec if refill_per_sec > 0 else math.inf
+
+    def stats(self) -> dict:
+        with self._lock:
+            return { "buckets": len(self._buckets), "max-buckets": self.max_buckets }
+
+    def _prune(self, now:float):
+        ## Drop the buckets that would have refilled by now (a full bucket is the same as no bucket)
+        for key in [ key for key, (_, updated_at, full_after) in self._buckets.items() if now - updated_at >= full_after ]:
+            del self._buckets[key]
+
+
+class _RateLimitStats:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, tokens:int, queued:bool, rejected:bool):
+        with self._lock:
+            if rejected:
+                self.rejected += 1
+                return
+            self.admitted += 1
+            self.tokens += tokens
+            if queued: self.queued += 1
+
+
+GLOBAL_RATE_LIMIT_BACKEND:RateLimitBackend = InMemoryRateLimitBackend()
+_STATS = _RateLimitStats()
+_ENCODING = None
+
+
+def set_rate_limit_backend(backend:RateLimitBackend):
+    """
+    Use a different store for the token buckets (eg. one shared by all instances of the app)
+    """
+    global GLOBAL_RATE_LIMIT_BACKEND
+    GLOBAL_RATE_LIMIT_BACKEND = backend
+
+
+def subscription_tier(context) -> str:
+    """
+    Returns the rate limit tier of the subscription of the request.
+
+    subauth's subscriptions don't carry a tier, so the tier is looked up by the id of the subscription in the `rate-limit-subscription-tiers` of the config, eg:
+        "rate-limit-subscription-tiers": { "<subscription id>": "premium" }
+    A `tier` on the subscription itself (if the subscription provider sets one) takes precedence. Any other subscription is in the "default" tier.
+    """
+    import json
+    subscription = context.subscription
+    if subscription is None: return DEFAULT_TIER
+    tier = getattr(subscription, "tier", None)
+    if type(tier) is str and len(tier) > 0:
+        return tier
+    tiers = context.get_config_value("rate-limit-subscription-tiers", None)
+    if type(tiers) is str:
+        tiers = json.loads(tiers)
+    sub_id = getattr(subscription, "id", None)
+    if isinstance(tiers, dict) and sub_id is not None:
+        return tiers.get(sub_id, None) or DEFAULT_TIER
+    return DEFAULT_TIER
+
+
+def resolve_rate_limit(context) -> dict:
+    """
+    Returns the rate limit for the subscription of the request (or None if it isn't limited).
+
+    Limits are per tier - the tier of the subscription (see `subscription_tier`) is looked up in the `rate-limit-tiers` of the config, eg:
+        "rate-limit-tiers": { "default": { "tokens-per-minute": 30000 }, "premium": { "tokens-per-minute": 300000, "burst": 600000, "max-wait-secs": 5 } }
+    Without tiers, the RATE_LIMIT_TOKENS_PER_MINUTE env variable is the limit for everyone.
+    """
+    import json
+    tier = subscription_tier(context)
+    tiers = context.get_config_value("rate-limit-tiers", None)
+    if type(tiers) is str:
+        tiers = json.loads(tiers)
+    limit = None
+    if tiers is not None:
+        limit = tiers.get(tier, None) or tiers.get(DEFAULT_TIER, None)
+    elif os.environ.get("RATE_LIMIT_TOKENS_PER_MINUTE", None) is not None:
+        limit = { "tokens-per-minute": float(os.environ["RATE_LIMIT_TOKENS_PER_MINUTE"]) }
+    if limit is None or not limit.get("tokens-per-minute", None):
+        return None
+    tpm = float(limit["tokens-per-minute"])
+    return {
+        "tier": tier,
+        "capacity": float(limit.get("burst", None) or tpm),
+        "refill-per-sec": tpm / 60.0,
+        "max-wait-secs": float(limit.get("max-wait-secs", None) or context.get_config_value("rate-limit-max-wait-secs", DEFAULT_RATE_LIMIT_MAX_WAIT_SECS)),
+    }
+
+
+def count_tokens(text:str) -> int:
+    """
+    Estimate the number of tokens in the text (using tiktoken, falling back to ~4 characters per token if the encoding can't be loaded)
+    """
+    global _ENCODING
+    if text is None or len(text) == 0: return 0
+    if _ENCODING is None:
+        try:
+            import tiktoken
+            _ENCODING = tiktoken.get_encoding(os.environ.get("TIKTOKEN_ENCODING", DEFAULT_TOKEN_ENCODING))
+        except Exception:
+            _ENCODING = False
+    if _ENCODING is False:
+        return len(text) // 4 + 1
+    return len(_ENCODING.encode(text, disallowed_special=()))
+
+
+def estimate_request_tokens(context, prompt:str, override_system_prompt:str = None) -> int:
+    """
+    Estimate the tokens the request will send to the model - the prompt, the system prompt + the history of the conversation (blocking, as the history is loaded if the request is part of a thread)
+    """
+    tokens = count_tokens(prompt) + DEFAULT_MESSAGE_OVERHEAD_TOKENS
+    if override_system_prompt is not None:
+        tokens += count_tokens(override_system_prompt) + DEFAULT_MESSAGE_OVERHEAD_TOKENS
+    if context.thread_id is not None:
+        context.init_history()  ## Ensure that the history for this conversation has been loaded
+        for msg in getattr(context, "history", None) or []:
+            tokens += count_tokens(getattr(msg, "message", None) or "") + DEFAULT_MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+
+async def admit_tokens(context, tokens:int) -> float:
+    """
+    Take the tokens from the bucket of the subscription of the request, waiting (briefly) for them if needed.
+
+    Returns None if the request is admitted, otherwise the seconds after which it can be retried
+    """
+    limit = resolve_rate_limit(context)
+    if limit is None: return None
+    key = f"{limit['tier']}:{context.user_id or 'anonymous'}"
+    ## A request bigger than the bucket could never be admitted, so it is charged a full bucket instead
+    tokens = min(tokens, limit["capacity"])
+    deadline = time.monotonic() + limit["max-wait-secs"]
+    queued = False
+    while True:
+        wait = GLOBAL_RATE_LIMIT_BACKEND.acquire(key, tokens, limit["capacity"], limit["refill-per-sec"])
+        if wait <= 0:
+            _STATS.record(tokens, queued, False)
+            return None
+        if time.monotonic() + wait > deadline:
+            _STATS.record(tokens, queued, True)
+            return wait
+        queued = True
+        await asyncio.sleep(wait)
+
+
+async def admit_request(context, prompt:str, override_system_prompt:str = None) -> float:
+    """
+    Admit the request (if its subscription has the tokens for it), returns None if admitted, otherwise the seconds after which it can be retried
+    """
+    if resolve_rate_limit(context) is None: return None
+    from utils.workers import run_blocking
+    tokens = await run_blocking(estimate_request_tokens, context, prompt, override_system_prompt)
+    return await admit_tokens(context, tokens)
+
+
+def rate_limited_response(retry_after:float) -> func.HttpResponse:
+    return func.HttpResponse(
+        status_code=429,
+        headers={
+            "reason": "Rate Limit Exceeded",
+            "retry-after": str(max(1, math.ceil(retry_after))) if retry_after != math.inf else "60",
+        },
+    )
+
+
+def rate_limit_stats() -> dict:
+    return {
+        "admitted": _STATS.admitted,
+        "queued": _STATS.queued,
+        "rejected": _STATS.rejected,
+        "tokens": _STATS.tokens,
+        **GLOBAL_RATE_LIMIT_BACKEND.stats(),
+    }
@@ -0,0 +1,38 @@
+import os
+
+import azure.functions as func
+
+DEFAULT_MAX_REQUEST_BODY_BYTES = 32 * 1024 * 1024
+
+## The largest request body that is accepted (larger requests are rejected with a 413 before they are authenticated or parsed)
+MAX_REQUEST_BODY_BYTES = int(os.environ.get("MAX_REQUEST_BODY_BYTES", DEFAULT_MAX_REQUEST_BODY_BYTES))
+
+
+def check_request_body_size(req:func.HttpRequest, max_bytes:int = None) -> func.HttpResponse:
+    """
+    Returns a 413 response if the body of the request is larger than the max allowed size, otherwise None
+    """
+    if max_bytes is None: max_bytes = MAX_REQUEST_BODY_BYTES
+    if max_bytes is None or max_bytes <= 0: return None
+
+    ## Use the declared length where there is one, otherwise the length of the (already received) body
+    size = None
+    content_length = req.headers.get("content-length", None) if req.headers is not None else None
+    if content_length is not None:
+        try:
+            size = int(content_length)
+        except ValueError:
+            size = None
+    if size is None and req.method in ("POST", "PUT", "PATCH"):
+        try:
+            size = len(req.get_body())
+        except Exception:
+            size = None
+
+    if size is None or size <= max_bytes: return None
+    return func.HttpResponse(
+        status_code=413,
+        headers={
+            "reason": f"Request body too large (max {max_bytes} bytes)",
+        },
+    )
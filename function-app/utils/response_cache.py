@@ -0,0 +1,158 @@
+import os
+import time
+import json
+import threading
+from collections import OrderedDict
+
+DEFAULT_COMPLETION_CACHE_MAX_BYTES = 32 * 1024 * 1024     ## 32MB across all cached responses
+DEFAULT_COMPLETION_CACHE_MAX_ITEM_BYTES = 256 * 1024      ## Responses larger than this are never cached
+
+## The outcomes reported in the `x-cache` header of the response
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+
+class CompletionResponseCache:
+    """
+    A thread-safe LRU cache of the (API) responses of completion requests, bounded by the total number of bytes held.
+
+    Each entry lives for the TTL of the config it was created for (`completion-cache-ttl`).
+    Entries are keyed by the version of the config, so a changed config never serves the responses of the previous version.
+    """
+
+    def __init__(self, max_bytes:int = DEFAULT_COMPLETION_CACHE_MAX_BYTES, max_item_bytes:int = DEFAULT_COMPLETION_CACHE_MAX_ITEM_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries:OrderedDict = OrderedDict()   ## key -> (expires_at, size, api response JSON)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def get(self, key:str) -> dict:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        ## Each hit gets its own copy of the response (so callers can't modify the cached one)
+        return json.loads(entry[2])
+
+    def put(self, key:str, api_resp:dict, ttl_secs:float):
+        if ttl_secs <= 0: return
+        data = json.dumps(api_resp, separators=(",", ":"))
+        size = len(data)
+        if size > self.max_item_bytes: return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl_secs, size, data)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 0:
+                self._remove(next(iter(self._entries)))
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def purge(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max-bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit-rate": (self.hits / lookups) if lookups > 0 else 0.0,
+            }
+
+    def _remove(self, key:str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+
+## The global cache of the responses to /completion requests (for the configs that opt in, via `completion-cache-ttl`)
+GLOBAL_COMPLETION_CACHE = CompletionResponseCache(
+    max_bytes=int(os.environ.get("COMPLETION_CACHE_MAX_BYTES", DEFAULT_COMPLETION_CACHE_MAX_BYTES)),
+    max_item_bytes=int(os.environ.get("COMPLETION_CACHE_MAX_ITEM_BYTES", DEFAULT_COMPLETION_CACHE_MAX_ITEM_BYTES)),
+)
+
+
+def completion_cache_ttl(context) -> float:
+    """
+    Returns the TTL of the cached responses for the config of the request (0 if the config doesn't opt in to caching)
+    """
+    ttl = context.get_config_value("completion-cache-ttl", None)
+    try:
+        return float(ttl) if ttl is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_cacheable_request(context) -> bool:
+    """
+    Only the requests that aren't part of a conversation (no thread) + don't have a stream to push updates to can be served from the cache
+    """
+    return context.thread_id is None and context.stream_id is None
+
+
+def request_cache_directives(context) -> set[str]:
+    """
+    Returns the (lower case) directives of the Cache-Control header of the request (eg. no-cache, no-store)
+    """
+    header = context.get_req_val("cache-control", None)
+    if header is None: return set()
+    return { part.strip().split("=", 1)[0].lower() for part in str(header).split(",") if len(part.strip()) > 0 }
+
+
+def completion_cache_key(context, prompt:str, override_system_prompt:str, use_functions:bool) -> str:
+    """
+    The key of a completion request - its normalised prompt, system prompt, use of functions, the version of its config + the values of the config's metadata-params (as they are sent with the prompt)
+    """
+    import hashlib
+    snapshot = context.config_snapshot
+    config_key = snapshot.key if snapshot is not None else (context.config_name, None)
+    mdp = context.config['metadata-params'] if context.config is not None else None
+    metadata = sorted((key, str(context.get_req_val(key, None))) for key in (mdp or []))
+    parts = ( normalise_prompt(prompt), override_system_prompt, bool(use_functions), config_key, metadata )
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def normalise_prompt(prompt:str) -> str:
+    ## Collapse whitespace (incl. leading/trailing), which doesn't change what is being asked
+    return " ".join(str(prompt).split())
+
+
+def lookup_completion(context, prompt:str, override_system_prompt:str, use_functions:bool) -> tuple[str, dict, str]:
+    """
+    Look up the cached response to a completion request, returns the (key to store the response under, cached API response, x-cache outcome)
+
+    The key is None when the response must not be cached, and the outcome is None when the config doesn't opt in to caching.
+    `Cache-Control: no-cache` skips the lookup (but the fresh response is cached), whereas `no-store` skips the cache entirely.
+    """
+    if completion_cache_ttl(context) <= 0: 
+        return None, None, None
+    directives = request_cache_directives(context)
+    if "no-store" in directives or not is_cacheable_request(context):
+        GLOBAL_COMPLETION_CACHE.record_bypass()
+        return None, None, CACHE_BYPASS
+    key = completion_cache_key(context, prompt, override_system_prompt, use_functions)
+    if "no-cache" in directives:
+        GLOBAL_COMPLETION_CACHE.record_bypass()
+        return key, None, CACHE_BYPASS
+    api_resp = GLOBAL_COMPLETION_CACHE.get(key)
+    return key, api_resp, CACHE_HIT if api_resp is not None else CACHE_MISS
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+_ABANDONED = object()   ## The result of a flight whose leader was cancelled before completing the call
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single call - the first caller (the leader) makes the call, whilst the callers that arrive before it completes wait on (+ share) its result.
+
+    Only calls that are in flight are shared, nothing is cached once the call has completed.
+    """
+
+    def __init__(self) -> None:
+        self._flights:dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key:str) -> tuple[Future, bool]:
+        """
+        Join the flight for the key, returns the (future of its result, whether the caller is the leader - and so must make the call + `land` it)
+        """
+        with self._lock:
+            flight = self._flights.get(key, None)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Future()
+            self.leaders += 1
+            return flight, True
+
+    def land(self, key:str, flight:Future, result:any = None, error:BaseException = None):
+        """
+        Complete the flight (called by the leader), passing the result (or error) to the callers waiting on it
+        """
+        with self._lock:
+            if self._flights.get(key, None) is flight:
+                del self._flights[key]
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def do(self, key:str, fn, *args, **kwargs) -> tuple[any, bool]:
+        """
+        Call the function (blocking), or wait for the identical call already in flight - returns the (result, whether it was shared)
+        """
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                result = flight.result()
+                if result is _ABANDONED: continue   ## The leader didn't complete the call, so (re)join to make it
+                return result, True
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.land(key, flight, error=e)
+                raise
+            except BaseException:
+                self.land(key, flight, _ABANDONED)
+                raise
+            self.land(key, flight, result)
+            return result, False
+
+    async def do_async(self, key:str, run, *args, **kwargs) -> tuple[any, bool]:
+        """
+        As per `do`, but awaits the (async) `run` (eg. `run_blocking`) for the leader, and waits for the result without blocking the event loop
+        """
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                ## Shielded, so a waiting caller that is cancelled (eg. the client went away) doesn't cancel the flight for everyone else
+                result = await asyncio.shield(asyncio.wrap_future(flight))
+                if result is _ABANDONED: continue   ## The leader was cancelled, so (re)join to make the call
+                return result, True
+            try:
+                result = await run(*args, **kwargs)
+            except Exception as e:
+                self.land(key, flight, error=e)
+                raise
+            except BaseException:
+                ## Cancelled (eg. the leader's client went away), which is not an error the callers waiting on it should see
+                self.land(key, flight, _ABANDONED)
+                raise
+            self.land(key, flight, result)
+            return result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "in-flight": len(self._flights),
+                "upstream-calls": self.leaders,
+                "coalesced": self.coalesced,
+                "coalescing-ratio": (self.coalesced / calls) if calls > 0 else 0.0,
+            }
+
+
+## The flights of the (thread-less) completion requests that are currently being sent to a proxy
+GLOBAL_COMPLETION_FLIGHTS = SingleFlight()
+
+
+def is_single_flight_enabled(context) -> bool:
+    """
+    Single-flight is off unless the config opts in to it (`completion-single-flight`)
+    """
+    enabled = context.get_config_value("completion-single-flight", None)
+    return enabled is not None and str(enabled).lower() in ['true', 'yes', '1']
+
+
+def completion_flight_key(context, prompt:str, override_system_prompt:str, use_functions:bool, cache_key:str = None) -> str:
+    """
+    The key of a completion request's flight - the response cache key (which covers the values of the config's metadata-params), plus the user (so requests are only shared by the same subscriber)
+
+    The response cache key is re-used if the request already has one (otherwise it is built)
+    """
+    from utils.response_cache import completion_cache_key
+    if cache_key is None:
+        cache_key = completion_cache_key(context, prompt, override_system_prompt, use_functions)
+    return f"{cache_key}:{context.user_id}"
@@ -0,0 +1,72 @@
+import json
+import asyncio
+
+import azure.functions as func
+
+SSE_HEADERS = {
+    "content-type": "text/event-stream",
+    "cache-control": "no-cache",
+    "x-accel-buffering": "no",
+}
+
+_END = object()     ## Marks the end of the event stream
+
+
+def format_sse(event:str, data:any) -> str:
+    """
+    Format an update as a Server-Sent Event
+    """
+    if type(data) is not str:
+        data = json.dumps(data, default=str)
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event or 'message'}\n{lines}\n"
+
+
+class EventQueue:
+    """
+    Bridges the updates pushed from a (worker) thread to the async generator that streams them as the body of a response
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue:asyncio.Queue = asyncio.Queue()
+
+    def push(self, update:any, event:str = None):
+        ## Can be called from any thread
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, update))
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _END)
+
+    async def events(self):
+        while True:
+            item = await self._queue.get()
+            if item is _END: break
+            yield format_sse(item[0], item[1])
+
+
+async def to_func_request(req) -> func.HttpRequest:
+    """
+    Convert a (FastAPI) request from a streaming route into a func.HttpRequest (so the same auth + context handling can be used)
+    """
+    return func.HttpRequest(
+        method=req.method,
+        url=str(req.url),
+        headers={ k:v for k,v in req.headers.items() },
+        params={ k:v for k,v in req.query_params.items() },
+        route_params={ k:v for k,v in req.path_params.items() },
+        body=await req.body(),
+    )
+
+
+def to_streaming_route_response(resp:func.HttpResponse):
+    """
+    Convert a func.HttpResponse (eg. a login response) into a response that can be returned from a streaming route
+    """
+    from azurefunctions.extensions.http.fastapi import Response
+    return Response(
+        content=resp.get_body(),
+        status_code=resp.status_code,
+        headers={ k:v for k,v in resp.headers.items() },
+        media_type=resp.mimetype,
+    )
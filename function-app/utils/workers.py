@@ -0,0 +1,80 @@
+import os
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+## The proxies (+ history providers / streams) are synchronous and spend almost all their time waiting on I/O, so the pool can be much larger than the number of cores
+DEFAULT_PROMPT_WORKER_THREADS = 256
+
+_PROMPT_EXECUTOR:ThreadPoolExecutor = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+class _InFlight:
+    def __init__(self) -> None:
+        self.count = 0
+        self.peak = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.count += 1
+            self.peak = max(self.peak, self.count)
+
+    def exit(self):
+        with self._lock:
+            self.count -= 1
+            self.completed += 1
+
+
+_IN_FLIGHT = _InFlight()
+
+
+def get_prompt_executor() -> ThreadPoolExecutor:
+    """
+    Returns the (dedicated) pool used to run the blocking parts of the prompt handlers - sized by PROMPT_WORKER_THREADS
+    """
+    global _PROMPT_EXECUTOR
+    if _PROMPT_EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _PROMPT_EXECUTOR is None:
+                max_workers = int(os.environ.get("PROMPT_WORKER_THREADS", DEFAULT_PROMPT_WORKER_THREADS))
+                _PROMPT_EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prompt-worker")
+    return _PROMPT_EXECUTOR
+
+
+async def run_blocking(fn, *args, **kwargs) -> any:
+    """
+    Run a blocking call (eg. auth, history load/save, stream push, the proxy call) on the prompt worker pool, without blocking the event loop
+    """
+    return await submit_blocking(fn, *args, **kwargs)
+
+
+def submit_blocking(fn, *args, **kwargs):
+    """
+    Run a blocking call on the prompt worker pool in the background (returns a Future for the result)
+    """
+    return asyncio.get_running_loop().run_in_executor(get_prompt_executor(), functools.partial(_run_tracked, fn, args, kwargs))
+
+
+def _run_tracked(fn, args:tuple, kwargs:dict) -> any:
+    _IN_FLIGHT.enter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _IN_FLIGHT.exit()
+
+
+def worker_stats() -> dict:
+    """
+    Returns the stats of the prompt worker pool (the number of blocking calls in flight, etc)
+    """
+    executor = _PROMPT_EXECUTOR
+    return {
+        "max-workers": executor._max_workers if executor is not None else int(os.environ.get("PROMPT_WORKER_THREADS", DEFAULT_PROMPT_WORKER_THREADS)),
+        "in-flight": _IN_FLIGHT.count,
+        "peak-in-flight": _IN_FLIGHT.peak,
+        "completed": _IN_FLIGHT.completed,
+    }